@@ -964,6 +964,10 @@ def duplicate_relationships_to_neo4j():
         session.run("MATCH (n) DETACH DELETE n")
         print("Neo4j очищен перед дублированием.")
 
+        # visitTime хранится как DATETIME; индексы позволяют искать ATTENDED по диапазону времени и по занятию
+        session.run("CREATE INDEX attended_visit_time IF NOT EXISTS FOR ()-[r:ATTENDED]-() ON (r.visitTime)")
+        session.run("CREATE INDEX attended_id_schedule IF NOT EXISTS FOR ()-[r:ATTENDED]-() ON (r.id_schedule)")
+
         # Создаем узлы
         for s_data in students:
             session.execute_write(run_tx, 
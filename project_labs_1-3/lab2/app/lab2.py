@@ -152,8 +152,8 @@ async def get_course_requirements(
             cypher_query = """
             MATCH (g:Group)-[att:ATTENDED]->(l:Lecture)
             WHERE l.id IN $lecture_ids
-            AND datetime(att.visitTime) >= datetime($start_date)
-            AND datetime(att.visitTime) <= datetime($end_date)
+            AND att.visitTime >= datetime($start_date)
+            AND att.visitTime <= datetime($end_date)
             MATCH (s:Student)-[:BELONGS_TO]->(g)
             RETURN l.id AS lecture_id, count(DISTINCT s) AS student_count
             """
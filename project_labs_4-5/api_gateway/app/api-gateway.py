@@ -3,8 +3,10 @@ from datetime import datetime, timedelta, timezone
 
 import httpx
 import jwt
-from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.background import BackgroundTask
 
 # --- JWT Configuration ---
 SECRET_KEY = "key"
@@ -81,82 +83,152 @@ LAB1_SERVICE_URL = "http://lab1:8000/visits"
 LAB2_SERVICE_URL = "http://lab2:8000/course-requirements"
 LAB3_SERVICE_URL = "http://lab3:8000/group"
 
+# --- Upstream HTTP clients ---
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 60.0))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30.0))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# One client (and connection pool) per upstream service, kept for the whole app lifetime
+upstream_clients: dict[str, httpx.AsyncClient] = {}
+
+@app.on_event("startup")
+async def open_upstream_clients():
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    for service in ("lab1", "lab2", "lab3"):
+        upstream_clients[service] = httpx.AsyncClient(
+            timeout=UPSTREAM_TIMEOUT, limits=limits, http2=UPSTREAM_HTTP2
+        )
+
+@app.on_event("shutdown")
+async def close_upstream_clients():
+    for client in upstream_clients.values():
+        await client.aclose()
+    upstream_clients.clear()
+
+# Upstream response headers passed through to the client (pagination cursor of lab1)
+FORWARDED_HEADERS = ("X-Next-Cursor",)
+
+async def forward_to_service(service: str, url: str, params: dict, response: Response | None = None):
+    client = upstream_clients[service]
+    try:
+        print(f"Forwarding request to {url} with params: {params}")
+        upstream_response = await client.get(url, params=params)
+        upstream_response.raise_for_status()
+        if response is not None:
+            for header in FORWARDED_HEADERS:
+                if header in upstream_response.headers:
+                    response.headers[header] = upstream_response.headers[header]
+        return upstream_response.json()
+    except httpx.HTTPStatusError as exc:
+        print(f"HTTP error occurred: {exc.response.status_code} - {exc.response.text}")
+        raise HTTPException(
+            status_code=exc.response.status_code,
+            detail=exc.response.json() if exc.response.content else f"Error from {service} service"
+        )
+    except httpx.RequestError as exc:
+        print(f"Request error occurred: {exc}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Error connecting to {service} service: {exc}",
+        )
+
+# --- Streaming (NDJSON) ---
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def stream_from_service(service: str, url: str, params: dict):
+    # The upstream body is relayed chunk by chunk as it arrives; the upstream
+    # response is closed once the client has received everything (or disconnected)
+    client = upstream_clients[service]
+    upstream_request = client.build_request("GET", url, params=params, headers={"Accept": NDJSON_MEDIA_TYPE})
+    try:
+        print(f"Streaming request to {url} with params: {params}")
+        upstream_response = await client.send(upstream_request, stream=True)
+    except httpx.RequestError as exc:
+        print(f"Request error occurred: {exc}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Error connecting to {service} service: {exc}",
+        )
+    if upstream_response.is_error:
+        await upstream_response.aread()
+        await upstream_response.aclose()
+        print(f"HTTP error occurred: {upstream_response.status_code} - {upstream_response.text}")
+        raise HTTPException(
+            status_code=upstream_response.status_code,
+            detail=upstream_response.json() if upstream_response.content else f"Error from {service} service"
+        )
+    headers = {
+        header: upstream_response.headers[header]
+        for header in FORWARDED_HEADERS
+        if header in upstream_response.headers
+    }
+    return StreamingResponse(
+        upstream_response.aiter_bytes(),
+        status_code=upstream_response.status_code,
+        media_type=upstream_response.headers.get("content-type", NDJSON_MEDIA_TYPE),
+        headers=headers,
+        background=BackgroundTask(upstream_response.aclose),
+    )
+
 @app.get("/lab1/visits")
 async def get_attendance_report(
+    request: Request,
+    response: Response,
     term: str,
     start_date: str,
     end_date: str,
+    limit: int | None = None,
+    cursor: str | None = None,
     current_user: dict = Depends(get_current_user)
 ):
     params = {"term": term, "start_date": start_date, "end_date": end_date}
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            print(f"Forwarding request to {LAB1_SERVICE_URL} with params: {params}")
-            response = await client.get(LAB1_SERVICE_URL, params=params)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            print(f"HTTP error occurred: {exc.response.status_code} - {exc.response.text}")
-            raise HTTPException(
-                status_code=exc.response.status_code, detail=exc.response.json() if exc.response.content else "Error from lab1 service"
-            )
-        except httpx.RequestError as exc:
-            print(f"Request error occurred: {exc}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Error connecting to lab1 service: {exc}",
-            )
+    if limit is not None:
+        params["limit"] = limit
+    if cursor:
+        params["cursor"] = cursor
+    if wants_ndjson(request):
+        return await stream_from_service("lab1", LAB1_SERVICE_URL, params)
+    return await forward_to_service("lab1", LAB1_SERVICE_URL, params, response)
+
 @app.get("/lab2/course-requirements")
 async def get_course_requirements(
+    request: Request,
     course_name: str,
     semester: int,
     year: int,
     current_user: dict = Depends(get_current_user)
 ):
     params = {"course_name": course_name, "semester": semester, "year": year}
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            print(f"Forwarding request to {LAB2_SERVICE_URL} with params: {params}")
-            response = await client.get(LAB2_SERVICE_URL, params=params)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            print(f"HTTP error occurred: {exc.response.status_code} - {exc.response.text}")
-            raise HTTPException(
-                status_code=exc.response.status_code,
-                detail=exc.response.json() if exc.response.content else "Error from lab2 service"
-            )
-        except httpx.RequestError as exc:
-            print(f"Request error occurred: {exc}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Error connecting to lab2 service: {exc}",
-            )
-        
+    if wants_ndjson(request):
+        return await stream_from_service("lab2", LAB2_SERVICE_URL, params)
+    return await forward_to_service("lab2", LAB2_SERVICE_URL, params)
+
 @app.get("/lab3/group")
 async def get_group_attendance(
+    request: Request,
     group_name: str,
+    start_date: str | None = None,
+    end_date: str | None = None,
     current_user: dict = Depends(get_current_user)
 ):
     params = {"group_name": group_name}
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            print(f"Forwarding request to {LAB3_SERVICE_URL} with params: {params}")
-            response = await client.get(LAB3_SERVICE_URL, params=params)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            print(f"HTTP error occurred: {exc.response.status_code} - {exc.response.text}")
-            raise HTTPException(
-                status_code=exc.response.status_code, detail=exc.response.json() if exc.response.content else "Error from lab3 service"
-            )
-        except httpx.RequestError as exc:
-            print(f"Request error occurred: {exc}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Error connecting to lab3 service: {exc}",
-            )
-        
+    if start_date:
+        params["start_date"] = start_date
+    if end_date:
+        params["end_date"] = end_date
+    if wants_ndjson(request):
+        return await stream_from_service("lab3", LAB3_SERVICE_URL, params)
+    return await forward_to_service("lab3", LAB3_SERVICE_URL, params)
+
 @app.get("/")
 async def root():
     return {"message": "API Gateway is running."}
@@ -0,0 +1,117 @@
+"""Benchmark of the lab1 student-selection strategies against one database.
+
+neo4j     DISTINCT student ids from the graph, then the SQL report with
+          s.id = ANY(student_ids)
+postgres  the SQL report alone, with an EXISTS semi-join on schedule
+
+Both strategies get the same lecture ids: a seeded random sample of the
+lectures table, which stands in for the Elasticsearch result of a broad term.
+The report is read without a LIMIT (or with --limit), and the two strategies
+must return the same (student_id, lecture_id, attendance_percentage) rows
+in the same order.
+Connection settings are read by lab1 from the usual environment variables.
+
+    pip install -r lab1/requirements.txt
+    POSTGRES_HOST=localhost NEO4J_HOST=localhost \\
+        python benchmarks/bench_lab1_student_source.py --lectures 300
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import statistics
+import time
+from datetime import date
+
+import psycopg
+from neo4j import AsyncGraphDatabase
+from psycopg.rows import dict_row
+
+LAB1_PATH = os.path.join(os.path.dirname(__file__), "..", "lab1", "app", "lab1.py")
+
+
+def load_lab1():
+    spec = importlib.util.spec_from_file_location("lab1", LAB1_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def run_strategy(lab1, conn, neo4j_driver, strategy, lecture_ids, period_start, period_end, limit):
+    student_ids = []
+    if strategy == "neo4j":
+        student_ids = await lab1.fetch_students_from_neo4j(neo4j_driver, lecture_ids)
+    async with conn.cursor() as cur:
+        await cur.execute(
+            lab1.build_attendance_query(strategy),
+            lab1.attendance_query_params(student_ids, lecture_ids, period_start, period_end, limit),
+        )
+        rows = await cur.fetchall()
+    return rows, len(student_ids)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lectures", type=int, default=300, help="число лекций в выборке")
+    parser.add_argument("--start-date", default="2025-01-01")
+    parser.add_argument("--end-date", default="2025-12-31")
+    parser.add_argument("--limit", type=int, default=None, help="размер отчета, по умолчанию без ограничения")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    lab1 = load_lab1()
+    period_start = date.fromisoformat(args.start_date)
+    period_end = date.fromisoformat(args.end_date)
+
+    conn = await psycopg.AsyncConnection.connect(
+        host=lab1.POSTGRES_HOST,
+        dbname=lab1.POSTGRES_DB,
+        user=lab1.POSTGRES_USER,
+        password=lab1.POSTGRES_PASSWORD,
+        port=5432,
+        autocommit=True,
+        row_factory=dict_row,
+    )
+    neo4j_driver = AsyncGraphDatabase.driver(lab1.NEO4J_URI, auth=(lab1.NEO4J_USER, lab1.NEO4J_PASSWORD))
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id FROM lectures ORDER BY id")
+            all_lecture_ids = [row["id"] for row in await cur.fetchall()]
+        lecture_ids = random.Random(args.seed).sample(all_lecture_ids, min(args.lectures, len(all_lecture_ids)))
+        print(f"lectures={len(lecture_ids)} period={args.start_date}..{args.end_date} repeat={args.repeat}")
+
+        results = {}
+        for strategy in lab1.STUDENT_SOURCES:
+            # Первый прогон прогревает кэши обеих баз и в замер не входит
+            rows, sent_ids = await run_strategy(
+                lab1, conn, neo4j_driver, strategy, lecture_ids, period_start, period_end, args.limit
+            )
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                await run_strategy(lab1, conn, neo4j_driver, strategy, lecture_ids, period_start, period_end, args.limit)
+                timings.append(time.perf_counter() - started)
+            results[strategy] = (rows, sent_ids, timings)
+    finally:
+        await conn.close()
+        await neo4j_driver.close()
+
+    # Порядок отчета полный (процент, student_id, lecture_id), поэтому строки сравниваются по порядку
+    reports = {
+        strategy: [(row["student_id"], row["lecture_id"], row["attendance_percentage"]) for row in rows]
+        for strategy, (rows, _, _) in results.items()
+    }
+    if reports["postgres"] != reports["neo4j"]:
+        raise SystemExit("Reports differ between the neo4j and postgres strategies")
+    print(f"report rows={len(reports['postgres'])}")
+
+    print(f"{'strategy':<10} | {'student ids sent':>16} | {'best s':>8} | {'median s':>8}")
+    print("-" * 52)
+    for strategy, (_, sent_ids, timings) in results.items():
+        print(f"{strategy:<10} | {sent_ids:>16} | {min(timings):>8.4f} | {statistics.median(timings):>8.4f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""Micro-benchmark of the lab3 attendance aggregation.
+
+Compares the former linear lookup of course_id per Neo4j row with
+lab3.aggregate_attendance, which uses a lecture_id -> course_id hash index.
+
+    pip install -r lab3/requirements.txt
+    python benchmarks/bench_lab3_aggregation.py --lectures 10000 --rows 100000
+"""
+import argparse
+import importlib.util
+import os
+import random
+import time
+
+LAB3_PATH = os.path.join(os.path.dirname(__file__), "..", "lab3", "app", "lab3.py")
+
+
+def load_lab3():
+    spec = importlib.util.spec_from_file_location("lab3", LAB3_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def aggregate_attendance_linear(student_schedule_data, lecture_data, attendance_by_pair):
+    # Прежняя реализация: поиск курса линейным проходом по lecture_data для каждой строки
+    student_attendance = {}
+    for student_id, lecture_id, schedule_id in student_schedule_data:
+        current_course_id = next((data["course_id"] for data in lecture_data if data["lecture_id"] == lecture_id), None)
+        if current_course_id:
+            attended_hours_for_this_schedule = attendance_by_pair.get((student_id, schedule_id), 0)
+            if student_id not in student_attendance:
+                student_attendance[student_id] = {}
+            if current_course_id not in student_attendance[student_id]:
+                student_attendance[student_id][current_course_id] = 0
+            student_attendance[student_id][current_course_id] += attended_hours_for_this_schedule
+    return student_attendance
+
+
+def generate_data(lectures, rows, students, courses, seed):
+    rnd = random.Random(seed)
+    lecture_data = [
+        {"lecture_id": lecture_id, "course_id": rnd.randint(1, courses)}
+        for lecture_id in range(1, lectures + 1)
+    ]
+    student_schedule_data = [
+        (rnd.randint(1, students), rnd.randint(1, lectures), rnd.randint(1, lectures * 2))
+        for _ in range(rows)
+    ]
+    attendance_by_pair = {
+        (student_id, schedule_id): rnd.randint(0, 20)
+        for student_id, _, schedule_id in student_schedule_data
+    }
+    return lecture_data, student_schedule_data, attendance_by_pair
+
+
+def measure(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lectures", type=int, default=10000)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--students", type=int, default=60)
+    parser.add_argument("--courses", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5, help="повторы для индексированной версии")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    lab3 = load_lab3()
+    lecture_data, student_schedule_data, attendance_by_pair = generate_data(
+        args.lectures, args.rows, args.students, args.courses, args.seed
+    )
+    print(f"lectures={args.lectures} rows={args.rows} students={args.students} courses={args.courses}")
+
+    def indexed():
+        lecture_courses = {row["lecture_id"]: row["course_id"] for row in lecture_data}
+        return lab3.aggregate_attendance(student_schedule_data, lecture_courses, attendance_by_pair)
+
+    indexed_time, indexed_result = measure(indexed, args.repeat)
+    # Линейная версия квадратична, поэтому запускается один раз
+    linear_time, linear_result = measure(
+        lambda: aggregate_attendance_linear(student_schedule_data, lecture_data, attendance_by_pair), 1
+    )
+
+    if indexed_result != linear_result:
+        raise SystemExit("Results differ between linear and indexed aggregation")
+
+    print(f"{'variant':<10} | {'seconds':>10}")
+    print("-" * 25)
+    print(f"{'linear':<10} | {linear_time:>10.4f}")
+    print(f"{'indexed':<10} | {indexed_time:>10.4f}")
+    print(f"speedup: x{linear_time / indexed_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
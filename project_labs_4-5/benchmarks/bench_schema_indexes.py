@@ -0,0 +1,182 @@
+"""Benchmark of the report queries with and without the secondary indexes of postgres.sql.
+
+Every CREATE INDEX IF NOT EXISTS of data_center/postgres.sql is part of the
+set. The report SQL is taken from the services themselves:
+
+lab1  build_attendance_query / attendance_query_params
+lab2  COURSE_IDS_QUERY, COURSE_LECTURES_QUERY / course_lectures_params
+lab3  GROUP_QUERY, GROUP_SCHEDULE_QUERY, GROUP_STUDENTS_QUERY,
+      GROUP_ATTENDANCE_QUERY / parse_report_period
+
+The "with" run uses the schema as is. The "without" run drops the indexes
+inside a transaction, repeats the same queries and rolls the transaction
+back, so the schema is left untouched. DROP INDEX holds an ACCESS EXCLUSIVE
+lock until the rollback: run it against a generated dataset, not a live one.
+
+    pip install -r lab1/requirements.txt -r lab2/requirements.txt -r lab3/requirements.txt
+    POSTGRES_HOST=localhost python benchmarks/bench_schema_indexes.py --lectures 300
+"""
+import argparse
+import importlib.util
+import os
+import random
+import re
+import statistics
+import time
+from datetime import date
+
+import psycopg
+from psycopg.rows import dict_row
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..")
+SCHEMA_PATH = os.path.join(APP_DIR, "data_center", "postgres.sql")
+INDEX_NAME = re.compile(r"CREATE INDEX IF NOT EXISTS (\w+)", re.IGNORECASE)
+
+
+def load_service(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(APP_DIR, name, "app", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def schema_indexes():
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        return INDEX_NAME.findall(f.read())
+
+
+def build_cases(cur, lab1, lab2, lab3, args):
+    """Запросы отчетов с параметрами, подобранными на текущих данных."""
+    cases = []
+
+    cur.execute("SELECT id FROM lectures ORDER BY id")
+    all_lecture_ids = [row["id"] for row in cur.fetchall()]
+    lecture_ids = random.Random(args.seed).sample(all_lecture_ids, min(args.lectures, len(all_lecture_ids)))
+    cases.append((
+        "lab1 attendance",
+        lab1.build_attendance_query("postgres"),
+        lab1.attendance_query_params(
+            [], lecture_ids, date.fromisoformat(args.start_date), date.fromisoformat(args.end_date)
+        ),
+    ))
+
+    course_ids_params = (lab2.course_name_pattern(args.course_name),)
+    cur.execute(lab2.COURSE_IDS_QUERY, course_ids_params)
+    course_ids = [row["id"] for row in cur.fetchall()]
+    semester_start, semester_end = lab2.get_semester_date_range(args.year, args.semester)
+    cases.append(("lab2 course ids", lab2.COURSE_IDS_QUERY, course_ids_params))
+    cases.append((
+        "lab2 lectures",
+        lab2.COURSE_LECTURES_QUERY,
+        lab2.course_lectures_params(course_ids, date.fromisoformat(semester_start), date.fromisoformat(semester_end)),
+    ))
+
+    if args.group_name:
+        group_name = args.group_name
+    else:
+        cur.execute("SELECT name FROM groups ORDER BY id LIMIT 1")
+        group_name = cur.fetchone()["name"]
+    cur.execute(lab3.GROUP_QUERY, (group_name,))
+    group = cur.fetchone()
+    if group is None:
+        raise SystemExit(f"Group {group_name} not found")
+    cur.execute(lab3.GROUP_SCHEDULE_QUERY, (group["id"],))
+    schedule_ids = [row["schedule_id"] for row in cur.fetchall()]
+    cur.execute(lab3.GROUP_STUDENTS_QUERY, (group["id"],))
+    student_ids = [row["id"] for row in cur.fetchall()]
+    # Пары (студент, занятие) строятся так же, как в lab3: все студенты группы на все ее занятия
+    pairs = [(student_id, schedule_id) for student_id in student_ids for schedule_id in schedule_ids]
+    cases.append(("lab3 group", lab3.GROUP_QUERY, (group_name,)))
+    cases.append(("lab3 schedule", lab3.GROUP_SCHEDULE_QUERY, (group["id"],)))
+    cases.append(("lab3 students", lab3.GROUP_STUDENTS_QUERY, (group["id"],)))
+    cases.append((
+        "lab3 attendance",
+        lab3.GROUP_ATTENDANCE_QUERY,
+        {
+            "student_ids": [student_id for student_id, _ in pairs],
+            "schedule_ids": [schedule_id for _, schedule_id in pairs],
+            **lab3.parse_report_period(args.start_date, args.end_date),
+        },
+    ))
+
+    print(
+        f"lectures={len(lecture_ids)} courses={len(course_ids)} group={group_name} "
+        f"pairs={len(pairs)} period={args.start_date}..{args.end_date} repeat={args.repeat}"
+    )
+    return cases
+
+
+def run_cases(cur, cases, repeat):
+    results = {}
+    for name, query, params in cases:
+        # Первый прогон прогревает кэш и в замер не входит
+        cur.execute(query, params)
+        rows = len(cur.fetchall())
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cur.execute(query, params)
+            cur.fetchall()
+            timings.append(time.perf_counter() - started)
+        results[name] = (rows, timings)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lectures", type=int, default=300, help="число лекций в выборке lab1")
+    parser.add_argument("--start-date", default="2025-03-05", help="период отчетов lab1 и lab3")
+    parser.add_argument("--end-date", default="2025-03-25")
+    parser.add_argument("--year", type=int, default=2025, help="учебный год отчета lab2")
+    parser.add_argument("--semester", type=int, default=2)
+    parser.add_argument("--course-name", default="", help="подстрока названия курса для lab2")
+    parser.add_argument("--group-name", default="", help="группа для lab3, по умолчанию первая по id")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    lab1 = load_service("lab1")
+    lab2 = load_service("lab2")
+    lab3 = load_service("lab3")
+
+    with psycopg.connect(
+        host=lab1.POSTGRES_HOST,
+        dbname=lab1.POSTGRES_DB,
+        user=lab1.POSTGRES_USER,
+        password=lab1.POSTGRES_PASSWORD,
+        port=5432,
+        autocommit=True,
+        row_factory=dict_row,
+    ) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+            existing = {row["indexname"] for row in cur.fetchall()}
+            indexes = [name for name in schema_indexes() if name.lower() in existing]
+            missing = [name for name in schema_indexes() if name.lower() not in existing]
+            if missing:
+                print(f"not in the database, skipped: {', '.join(missing)}")
+
+            cases = build_cases(cur, lab1, lab2, lab3, args)
+            with_indexes = run_cases(cur, cases, args.repeat)
+
+            with conn.transaction(force_rollback=True):
+                # Индекс партиционированной таблицы удаляется вместе с индексами партиций
+                for name in indexes:
+                    cur.execute(f"DROP INDEX {name}")
+                without_indexes = run_cases(cur, cases, args.repeat)
+
+    print(f"dropped and restored {len(indexes)} indexes")
+    print(f"{'query':<16} | {'rows':>6} | {'without s':>9} | {'with s':>9} | {'speedup':>7}")
+    print("-" * 60)
+    for name, _, _ in cases:
+        rows, timings = with_indexes[name]
+        rows_without, timings_without = without_indexes[name]
+        if rows != rows_without:
+            raise SystemExit(f"{name}: {rows_without} rows without indexes, {rows} with them")
+        before = statistics.median(timings_without)
+        after = statistics.median(timings)
+        print(f"{name:<16} | {rows:>6} | {before:>9.4f} | {after:>9.4f} | {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
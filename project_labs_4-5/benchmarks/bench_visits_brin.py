@@ -0,0 +1,122 @@
+"""Benchmark of index variants for visitTime range filters: none, B-tree and BRIN.
+
+Each variant gets a scratch copy of visits (bench_visits_<variant>, dropped
+at the end) with only its own index. The rows generated by
+data_center/generator.py are inserted in visitTime order, as visits arrive.
+The script reports the insert throughput and the index size. It also runs
+seeded random visitTime windows of --window-hours and reports the count(*)
+latency for each.
+
+    pip install psycopg[binary]
+    POSTGRES_HOST=localhost python benchmarks/bench_visits_brin.py --pages-per-range 16 32 128
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "mirea")
+POSTGRES_DB = os.getenv("POSTGRES_DB", "university")
+
+
+def variants(pages_per_range):
+    yield "none", None
+    yield "btree", "CREATE INDEX {index} ON {table} (visitTime)"
+    for pages in pages_per_range:
+        yield f"brin_{pages}", f"CREATE INDEX {{index}} ON {{table}} USING brin (visitTime) WITH (pages_per_range = {pages})"
+
+
+def run_variant(cur, name, index_ddl, windows, repeat):
+    table = sql.Identifier(f"bench_visits_{name}")
+    index = sql.Identifier(f"bench_visits_{name}_idx")
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(table))
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE visits)").format(table))
+    if index_ddl:
+        cur.execute(sql.SQL(index_ddl).format(index=index, table=table))
+
+    started = time.perf_counter()
+    cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM visits ORDER BY visitTime").format(table))
+    insert_seconds = time.perf_counter() - started
+    rows = cur.rowcount
+    cur.execute(sql.SQL("ANALYZE {}").format(table))
+
+    index_size = 0
+    if index_ddl:
+        cur.execute("SELECT pg_relation_size(%s::regclass) AS size", (f"bench_visits_{name}_idx",))
+        index_size = cur.fetchone()["size"]
+
+    query = sql.SQL("SELECT count(*) FROM {} WHERE visitTime BETWEEN %s AND %s").format(table)
+    # Первый проход прогревает кэш и в замер не входит
+    for window in windows:
+        cur.execute(query, window)
+    timings = []
+    for _ in range(repeat):
+        for window in windows:
+            started = time.perf_counter()
+            cur.execute(query, window)
+            cur.fetchone()
+            timings.append(time.perf_counter() - started)
+
+    cur.execute(sql.SQL("DROP TABLE {}").format(table))
+    return rows, insert_seconds, index_size, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages-per-range", type=int, nargs="+", default=[32], help="варианты BRIN")
+    parser.add_argument("--window-hours", type=int, default=24, help="длина окна запроса по visitTime")
+    parser.add_argument("--windows", type=int, default=20, help="число случайных окон")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with psycopg.connect(
+        host=POSTGRES_HOST,
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        port=5432,
+        autocommit=True,
+        row_factory=dict_row,
+    ) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT min(visitTime) AS first, max(visitTime) AS last FROM visits")
+            bounds = cur.fetchone()
+            if bounds["first"] is None:
+                raise SystemExit("visits is empty, run data_center/generator.py first")
+            window = timedelta(hours=args.window_hours)
+            span = max((bounds["last"] - bounds["first"] - window).total_seconds(), 0)
+            rng = random.Random(args.seed)
+            windows = []
+            for _ in range(args.windows):
+                start = bounds["first"] + timedelta(seconds=rng.uniform(0, span))
+                windows.append((start, start + window))
+            print(
+                f"visits {bounds['first']}..{bounds['last']} window={args.window_hours}h "
+                f"windows={args.windows} repeat={args.repeat}"
+            )
+
+            results = {}
+            for name, index_ddl in variants(args.pages_per_range):
+                results[name] = run_variant(cur, name, index_ddl, windows, args.repeat)
+
+    print(f"{'index':<10} | {'rows':>9} | {'insert rows/s':>13} | {'index size':>12} | {'median ms':>9} | {'p95 ms':>8}")
+    print("-" * 76)
+    for name, (rows, insert_seconds, index_size, timings) in results.items():
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        print(
+            f"{name:<10} | {rows:>9} | {rows / insert_seconds:>13.0f} | {index_size / 1024:>9.0f} kB | "
+            f"{statistics.median(timings) * 1000:>9.2f} | {p95 * 1000:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
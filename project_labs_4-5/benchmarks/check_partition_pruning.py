@@ -0,0 +1,156 @@
+"""EXPLAIN-based check that the lab1 and lab2 report queries prune visits partitions.
+
+The queries and their parameters come from the services themselves
+(lab1.build_attendance_query / attendance_query_params and
+lab2.COURSE_LECTURES_QUERY / course_lectures_params). Parameters are bound on
+the client, so the plan shows plan-time pruning. The script fails if a
+query touches a weekly partition outside the requested period, or misses
+one inside it. The DEFAULT partition, if present, is allowed in either case.
+lab1 reads full weeks from visits_weekly_rollup, so only the partitions of
+its partial edge weeks are expected there.
+
+    pip install -r lab1/requirements.txt -r lab2/requirements.txt
+    POSTGRES_HOST=localhost python benchmarks/check_partition_pruning.py
+"""
+import argparse
+import importlib.util
+import json
+import os
+import re
+import sys
+from datetime import date
+
+import psycopg
+from psycopg.rows import dict_row
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..")
+PARTITION_BOUND = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+
+
+def load_service(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(APP_DIR, name, "app", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_partitions(cur):
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass
+        """
+    )
+    partitions = {}
+    default_partitions = set()
+    for row in cur.fetchall():
+        match = PARTITION_BOUND.search(row["bound"])
+        if match:
+            partitions[row["relname"]] = (date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2)))
+        else:
+            default_partitions.add(row["relname"])
+    return partitions, default_partitions
+
+
+def scanned_relations(plan):
+    relations = set()
+    if "Relation Name" in plan:
+        relations.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        relations |= scanned_relations(child)
+    return relations
+
+
+def check(cur, name, query, params, partitions, default_partitions):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    touched = scanned_relations(plan[0]["Plan"]) & (set(partitions) | default_partitions)
+    # Партиция [from, to) нужна, если ее диапазон пересекается с [week_start_from, week_start_to],
+    # а для запросов с edge_weeks - если в нее попадает одна из крайних недель
+    if "edge_weeks" in params:
+        expected = {
+            relname for relname, (lower, upper) in partitions.items()
+            if any(lower <= week < upper for week in params["edge_weeks"])
+        }
+    else:
+        expected = {
+            relname for relname, (lower, upper) in partitions.items()
+            if lower <= params["week_start_to"] and upper > params["week_start_from"]
+        }
+    unexpected = touched - expected - default_partitions
+    missing = expected - touched
+    status = "ok" if not unexpected and not missing else "FAIL"
+    print(
+        f"{name:<5} | {params['week_start_from']}..{params['week_start_to']} | "
+        f"{len(touched - default_partitions):>3} of {len(partitions)} partitions | {status}"
+    )
+    if unexpected:
+        print(f"      unexpected partitions: {sorted(unexpected)}")
+    if missing:
+        print(f"      missing partitions: {sorted(missing)}")
+    return status == "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start-date", default="2025-03-05", help="период отчета lab1")
+    parser.add_argument("--end-date", default="2025-03-25")
+    parser.add_argument("--year", type=int, default=2025, help="учебный год отчета lab2")
+    parser.add_argument("--semester", type=int, default=2)
+    parser.add_argument("--course-name", default="", help="подстрока названия курса для lab2")
+    args = parser.parse_args()
+
+    lab1 = load_service("lab1")
+    lab2 = load_service("lab2")
+
+    with psycopg.connect(
+        host=lab1.POSTGRES_HOST,
+        dbname=lab1.POSTGRES_DB,
+        user=lab1.POSTGRES_USER,
+        password=lab1.POSTGRES_PASSWORD,
+        port=5432,
+        autocommit=True,
+        row_factory=dict_row,
+        cursor_factory=psycopg.ClientCursor,
+    ) as conn:
+        with conn.cursor() as cur:
+            partitions, default_partitions = load_partitions(cur)
+            if not partitions:
+                raise SystemExit("visits has no range partitions")
+            cur.execute("SELECT id FROM lectures ORDER BY id LIMIT 100")
+            lecture_ids = [row["id"] for row in cur.fetchall()]
+
+            semester_start, semester_end = lab2.get_semester_date_range(args.year, args.semester)
+            cur.execute(lab2.COURSE_IDS_QUERY, (lab2.course_name_pattern(args.course_name),))
+            course_ids = [row["id"] for row in cur.fetchall()]
+            results = [
+                check(
+                    cur,
+                    "lab1",
+                    lab1.build_attendance_query("postgres"),
+                    lab1.attendance_query_params(
+                        [], lecture_ids, date.fromisoformat(args.start_date), date.fromisoformat(args.end_date)
+                    ),
+                    partitions,
+                    default_partitions,
+                ),
+                check(
+                    cur,
+                    "lab2",
+                    lab2.COURSE_LECTURES_QUERY,
+                    lab2.course_lectures_params(
+                        course_ids, date.fromisoformat(semester_start), date.fromisoformat(semester_end)
+                    ),
+                    partitions,
+                    default_partitions,
+                ),
+            ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
+import argparse
+import io
 import json
 import os
 import random
-import time
-from datetime import date, datetime, timedelta
+import re
+from datetime import date, datetime, time, timedelta
 
 import psycopg2
 from faker import Faker
@@ -10,6 +12,8 @@ from faker.providers import BaseProvider
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor, execute_values
 
+import partition_maintenance
+
 
 # Кастомные названия
 class UniversityProvider(BaseProvider):
@@ -108,16 +112,6 @@ pg_conn = psycopg2.connect(
     user="postgres", password="mirea"
 )
 
-# Генерация случайных дат
-def generate_random_date(start_date, end_date):
-    days_between = (end_date - start_date).days
-    times = ['09:00', '11:00', '13:00', '15:00']
-    random_days = random.randint(0, days_between)
-    random_date = start_date + timedelta(days=random_days)
-    random_time = random.choice(times)
-    random_datetime = datetime.strptime(f"{random_date.strftime('%Y-%m-%d')} {random_time}", '%Y-%m-%d %H:%M')
-    return random_datetime
-
 def get_week_start(input_date):
     if isinstance(input_date, str):
         try:
@@ -134,14 +128,67 @@ def get_week_start(input_date):
 start_date_semester = datetime.strptime("2025-01-10", "%Y-%m-%d")
 end_date_semester = datetime.strptime("2025-12-20", "%Y-%m-%d")
 
+# Объемы данных при масштабе 1. Счетчики умножаются на --scale (как SF в TPC-H), доли на родителя
+# (кафедр на институт, занятий на группу, посещений на студента) не меняются, поэтому зависимые
+# таблицы растут вместе с родительскими. Специальности - справочник из 40 кодов, он не масштабируется
+SCALED_VOLUMES = ("institutes", "groups", "students", "courses", "lectures", "materials")
+VOLUMES = {
+    "institutes": 9,
+    "kafedras_per_institute": 3,
+    "specialties": 40,
+    "groups": 100,
+    "students": 1500,
+    "courses": 100,
+    "lectures": 900,
+    "materials": 1500,             # не больше 1-2 на лекцию
+    "schedules_per_group": (5, 7),
+    "visits_per_student": (40, 50),
+}
+
+def scale_volumes(scale, overrides):
+    volumes = dict(VOLUMES)
+    for name in SCALED_VOLUMES:
+        volumes[name] = max(1, round(volumes[name] * scale))
+    volumes.update({name: value for name, value in overrides.items() if value is not None})
+    return volumes
+
 # Чтение SQL-файла
+DOLLAR_QUOTE = re.compile(r"\$[A-Za-z_][A-Za-z0-9_]*\$|\$\$")
+
+def split_sql(sql_text):
+    # Делит скрипт по ";", пропуская точки с запятой внутри строк, комментариев
+    # и тел функций в долларовых кавычках ($$ ... $$, $tag$ ... $tag$)
+    queries = []
+    start = 0
+    i = 0
+    while i < len(sql_text):
+        if sql_text.startswith("--", i):
+            end = sql_text.find("\n", i)
+            i = len(sql_text) if end == -1 else end + 1
+        elif sql_text[i] == "'":
+            end = sql_text.find("'", i + 1)
+            while end != -1 and sql_text.startswith("''", end):
+                end = sql_text.find("'", end + 2)
+            i = len(sql_text) if end == -1 else end + 1
+        elif sql_text[i] == "$" and DOLLAR_QUOTE.match(sql_text, i):
+            tag = DOLLAR_QUOTE.match(sql_text, i).group()
+            end = sql_text.find(tag, i + len(tag))
+            i = len(sql_text) if end == -1 else end + len(tag)
+        elif sql_text[i] == ";":
+            queries.append(sql_text[start:i])
+            i += 1
+            start = i
+        else:
+            i += 1
+    queries.append(sql_text[start:])
+    return [q.strip() for q in queries if q.strip()]
+
 def read_sql(filepath):
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Файл {filepath} не найден")
     with open(filepath, 'r') as f:
         sql_queries = f.read()
-    queries = [q.strip() for q in sql_queries.split(";") if q.strip()]
-    return queries
+    return split_sql(sql_queries)
 
 # Создание таблиц
 def create_tables():
@@ -162,39 +209,18 @@ def create_tables():
             is_partitioned = cur.fetchone()[0]
             print(f"Таблица visits партиционирована: {is_partitioned}")
             
-            if is_partitioned:
-                date_start_partition = datetime.strptime("2025-01-06", "%Y-%m-%d") # Убедимся, что это Monday
-                date_end_partition = datetime.strptime("2025-12-28", "%Y-%m-%d") # Убедимся, что это Sunday + 1 day for range
-
-                cur.execute("""
-                    SELECT table_name
-                    FROM information_schema.tables
-                    WHERE table_name LIKE 'visits_2025_%';
-                """)
-                existing_partitions = cur.fetchall()
-                for part in existing_partitions:
-                    print(f"Удаление существующей партиции: {part[0]}")
-                    cur.execute(f"DROP TABLE IF EXISTS {part[0]} CASCADE;")
-
-                i = 1
-                current_partition_start_date = date_start_partition
-                while current_partition_start_date < date_end_partition:
-                    start_date_str = current_partition_start_date.strftime('%Y-%m-%d')
-                    next_partition_start_date = current_partition_start_date + timedelta(days=7)
-                    end_date_str = next_partition_start_date.strftime('%Y-%m-%d')
-                    
-                    partition_name = f"visits_2025_w{i}"
-                    print(f"Создание партиции {partition_name}: FOR VALUES FROM ('{start_date_str}') TO ('{end_date_str}')")
-                    cur.execute(
-                        f"CREATE TABLE {partition_name} PARTITION OF visits "
-                        f"FOR VALUES FROM ('{start_date_str}') TO ('{end_date_str}');"
-                    )
-                    current_partition_start_date = next_partition_start_date
-                    i += 1
-            
             cur.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'institutes');")
             exists = cur.fetchone()[0]
             print(f"Таблица institutes существует: {exists}")
+
+        if is_partitioned:
+            # Недельные партиции на весь период генерации плюс DEFAULT для всего, что вне него
+            pg_conn.autocommit = False
+            partition_maintenance.ensure_default_partition(pg_conn)
+            created = partition_maintenance.create_partitions(
+                pg_conn, get_week_start(start_date_semester), get_week_start(end_date_semester)
+            )
+            print(f"Создано партиций visits: {created}")
         print("Таблицы и партиции успешно созданы или уже существовали")
     except psycopg2.Error as e:
         print(f"Ошибка psycopg2 при создании таблиц: {e}")
@@ -210,19 +236,10 @@ def clear_all_data():
         # Очистка PostgreSQL
         pg_conn.autocommit = True
         with pg_conn.cursor() as cur:
-            cur.execute("""
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_name LIKE 'visits_2025_w%';
-            """)
-            partitions = cur.fetchall()
-            for partition in partitions:
-                partition_name = partition[0]
-                cur.execute(f"DROP TABLE IF EXISTS {partition_name} CASCADE;")
-                print(f"Удалена партиция {partition_name}")
-
+            # Партиции visits (недельные и DEFAULT) удаляются вместе с самой таблицей
             cur.execute("""
                 DROP TABLE IF EXISTS visits CASCADE;
+                DROP TABLE IF EXISTS visits_weekly_rollup CASCADE;
                 DROP TABLE IF EXISTS schedule CASCADE;
                 DROP TABLE IF EXISTS materials CASCADE;
                 DROP TABLE IF EXISTS lectures CASCADE;
@@ -241,22 +258,74 @@ def clear_all_data():
     finally:
         pg_conn.autocommit = False
 
+# Загрузка строк: INSERT ... VALUES через execute_values или COPY FROM STDIN
+LOADERS = ("values", "copy")
+LOADER = "values"        # для всех таблиц, кроме visits
+VISITS_LOADER = "copy"   # для visits
+INSERT_PAGE_SIZE = 10000
+COPY_BATCH_SIZE = 100000
+
+def allocate_ids(cur, table, count):
+    # id выдаются заранее из последовательности SERIAL, поэтому RETURNING не нужен и для COPY
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+        (table, count)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+def copy_value(value):
+    # Текстовый формат COPY: NULL - \N, спецсимволы экранируются обратной косой чертой
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+def copy_rows(cur, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(
+        sql.SQL("COPY {} ({}) FROM STDIN").format(sql.Identifier(table), sql.SQL(", ".join(columns))),
+        buffer
+    )
+
+def insert_rows(cur, table, columns, rows, loader=None):
+    loader = loader or LOADER
+    if loader == "copy":
+        for i in range(0, len(rows), COPY_BATCH_SIZE):
+            copy_rows(cur, table, columns, rows[i:i + COPY_BATCH_SIZE])
+    else:
+        execute_values(
+            cur,
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+            rows,
+            page_size=INSERT_PAGE_SIZE
+        )
+    return len(rows)
+
 # Функции вставки данных
 def insert_universities(cur):
-    university = {"name": fake.university_name()}
-    sql_query = "INSERT INTO universities (name) VALUES (%s) RETURNING id, name;"
-    cur.execute(sql_query, (university["name"],))
-    fetched_universities = cur.fetchall()
-    return [{"id": r[0], "name": r[1]} for r in fetched_universities]
+    university = {"id": allocate_ids(cur, "universities", 1)[0], "name": fake.university_name()}
+    insert_rows(cur, "universities", ("id", "name"), [(university["id"], university["name"])])
+    return [university]
 
 def insert_institutes(cur, university_id):
-    institutes_props = [{"name": fake.institute_name(), "id_university": university_id} for _ in range(9)]
-    values = [(inst["name"], inst["id_university"]) for inst in institutes_props]
-    sql_query = "INSERT INTO institutes (name, id_university) VALUES %s RETURNING id, name, id_university;"
+    institutes_props = [{"name": fake.institute_name(), "id_university": university_id} for _ in range(VOLUMES["institutes"])]
     try:
-        results_tuples = execute_values(cur, sql_query, values, fetch=True)
-        print(f"Вставлено институтов: {len(results_tuples)}")
-        return [{"id": r[0], "name": r[1], "id_university": r[2]} for r in results_tuples]
+        for inst, inst_id in zip(institutes_props, allocate_ids(cur, "institutes", len(institutes_props))):
+            inst["id"] = inst_id
+        values = [(inst["id"], inst["name"], inst["id_university"]) for inst in institutes_props]
+        print(f"Вставлено институтов: {insert_rows(cur, 'institutes', ('id', 'name', 'id_university'), values)}")
+        return institutes_props
     except Exception as e:
         print(f"Ошибка в insert_institutes: {e}")
         raise
@@ -265,22 +334,22 @@ def insert_kafedras(cur, institutes):
     kafedras_props = []
     for inst in institutes:
         inst_id = inst["id"]
-        for _ in range(3):
+        for _ in range(VOLUMES["kafedras_per_institute"]):
             kafedras_props.append({"name": fake.department_name(), "id_institutes": inst_id})
-    
-    values = [(k["name"], k["id_institutes"]) for k in kafedras_props]
-    sql_query = "INSERT INTO kafedras (name, id_institutes) VALUES %s RETURNING id, name, id_institutes;"
-    results_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено кафедр: {len(results_tuples)}")
-    return [{"id": r[0], "name": r[1], "id_institutes": r[2]} for r in results_tuples]
+
+    for kaf, kaf_id in zip(kafedras_props, allocate_ids(cur, "kafedras", len(kafedras_props))):
+        kaf["id"] = kaf_id
+    values = [(k["id"], k["name"], k["id_institutes"]) for k in kafedras_props]
+    print(f"Вставлено кафедр: {insert_rows(cur, 'kafedras', ('id', 'name', 'id_institutes'), values)}")
+    return kafedras_props
 
 def insert_specialties(cur):
-    specialties_props = [fake.specialty() for _ in range(40)]
-    values = [(s[1], s[0]) for s in specialties_props]
-    sql_query = "INSERT INTO specialties (name, code) VALUES %s RETURNING id, name, code;"
-    results_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено специальностей: {len(results_tuples)}")
-    return [{"id": r[0], "name": r[1], "code": r[2]} for r in results_tuples]
+    specialties_props = [{"code": code, "name": name} for code, name in (fake.specialty() for _ in range(VOLUMES["specialties"]))]
+    for spec, spec_id in zip(specialties_props, allocate_ids(cur, "specialties", len(specialties_props))):
+        spec["id"] = spec_id
+    values = [(s["id"], s["name"], s["code"]) for s in specialties_props]
+    print(f"Вставлено специальностей: {insert_rows(cur, 'specialties', ('id', 'name', 'code'), values)}")
+    return specialties_props
 
 def insert_kafedra_specialties(cur, kafedras, specialties):
     values = []
@@ -293,14 +362,13 @@ def insert_kafedra_specialties(cur, kafedras, specialties):
     if not values:
         print("Нет данных для вставки в kafedra_specialties.")
         return
-    sql_query = "INSERT INTO kafedra_specialties (id_kafedra, id_specialty) VALUES %s;"
-    execute_values(cur, sql_query, values)
+    insert_rows(cur, "kafedra_specialties", ("id_kafedra", "id_specialty"), values)
 
 def insert_groups(cur, kafedras):
     groups_props = []
     start_year = datetime.strptime("2021-09-01", "%Y-%m-%d").date()
 
-    for _ in range(100):
+    for _ in range(VOLUMES["groups"]):
         kaf = random.choice(kafedras)
 
         current_start_year = start_year.year - random.randint(0,3)
@@ -315,26 +383,18 @@ def insert_groups(cur, kafedras):
             "startYear": group_start_date,
             "endYear": group_end_date
         })
-    values = [(g["name"], g["id_kafedra"], g["startYear"], g["endYear"]) for g in groups_props]
-    sql_query = "INSERT INTO groups (name, id_kafedra, startYear, endYear) VALUES %s RETURNING id, name, id_kafedra;"
-    results_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено групп: {len(results_tuples)}")
-    
-    final_groups_list = []
-    if len(results_tuples) == len(groups_props):
-        for i, r_tuple in enumerate(results_tuples):
-            final_groups_list.append({"id": r_tuple[0], "name": r_tuple[1], "id_kafedra": r_tuple[2]})
-    else:
-        final_groups_list = [{"id": r_tuple[0], "name": r_tuple[1], "id_kafedra": r_tuple[2]} for r_tuple in results_tuples]
-        print(f"Предупреждение: Несоответствие количества вставленных групп. Ожидалось {len(groups_props)}, вставлено {len(results_tuples)}")
+    group_ids = allocate_ids(cur, "groups", len(groups_props))
+    values = [(group_id, g["name"], g["id_kafedra"], g["startYear"], g["endYear"]) for group_id, g in zip(group_ids, groups_props)]
+    inserted = insert_rows(cur, "groups", ("id", "name", "id_kafedra", "startYear", "endYear"), values)
+    print(f"Вставлено групп: {inserted}")
 
-    return final_groups_list
+    return [{"id": group_id, "name": g["name"], "id_kafedra": g["id_kafedra"]} for group_id, g in zip(group_ids, groups_props)]
 
 
 def insert_students(cur, groups):
     students_props = []
     admission_date_base = datetime.strptime("2021-09-01", "%Y-%m-%d").date()
-    total_students = 1500
+    total_students = VOLUMES["students"]
     
     if not groups:
         print("Нет групп для добавления студентов.")
@@ -364,26 +424,16 @@ def insert_students(cur, groups):
         print("Нет студентов для вставки.")
         return []
 
-    values = [(s["fio"], s["id_group"], s["date_of_admission"]) for s in students_props]
-    sql_query = "INSERT INTO students (fio, id_group, date_of_admission) VALUES %s RETURNING id;"
-    
-    returned_ids_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено студентов: {len(returned_ids_tuples)}")
-
-    if len(returned_ids_tuples) == len(students_props):
-        for i, id_tuple in enumerate(returned_ids_tuples):
-            students_props[i]["id"] = id_tuple[0]
-    '''
-    else:
-        print(f"Предупреждение: Количество возвращенных ID студентов ({len(returned_ids_tuples)}) не совпадает с количеством для вставки ({len(students_props)})")
-        updated_students_list = []
-        temp_students_map = { (s["fio"], s["id_group"], s["date_of_admission"]): s for s in students_props}
-    '''
+    for student, student_id in zip(students_props, allocate_ids(cur, "students", len(students_props))):
+        student["id"] = student_id
+    values = [(s["id"], s["fio"], s["id_group"], s["date_of_admission"]) for s in students_props]
+    inserted = insert_rows(cur, "students", ("id", "fio", "id_group", "date_of_admission"), values)
+    print(f"Вставлено студентов: {inserted}")
     return students_props
 
 def insert_courses(cur, kafedras, specialties):
     courses_props = []
-    for _ in range(100):
+    for _ in range(VOLUMES["courses"]):
         if not kafedras or not specialties: break
         kaf = random.choice(kafedras)
         spec = random.choice(specialties)
@@ -396,17 +446,17 @@ def insert_courses(cur, kafedras, specialties):
     if not courses_props:
         print("Нет курсов для вставки.")
         return []
-        
-    values = [(c["name"], c["id_kafedra"], c["id_specialty"], c["planned_hours"]) for c in courses_props]
-    sql_query = "INSERT INTO courses (name, id_kafedra, id_specialty, planned_hours) VALUES %s RETURNING id, id_kafedra, id_specialty;"
-    results_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено курсов: {len(results_tuples)}")
-    return [{"id": r[0], "id_kafedra": r[1], "id_specialty": r[2]} for r in results_tuples]
+
+    course_ids = allocate_ids(cur, "courses", len(courses_props))
+    values = [(course_id, c["name"], c["id_kafedra"], c["id_specialty"], c["planned_hours"]) for course_id, c in zip(course_ids, courses_props)]
+    inserted = insert_rows(cur, "courses", ("id", "name", "id_kafedra", "id_specialty", "planned_hours"), values)
+    print(f"Вставлено курсов: {inserted}")
+    return [{"id": course_id, "id_kafedra": c["id_kafedra"], "id_specialty": c["id_specialty"]} for course_id, c in zip(course_ids, courses_props)]
 
 
 def insert_lectures(cur, courses):
     lectures_props = []
-    target_lectures = 900
+    target_lectures = VOLUMES["lectures"]
 
     if not courses:
         print("Нет курсов для создания лекций.")
@@ -434,13 +484,11 @@ def insert_lectures(cur, courses):
         print("Нет лекций для вставки.")
         return []
 
-    values = [(l["name"], l["id_course"], l["duration_hours"], l["requirements"], l["text_requirements"]) for l in lectures_props]
-    # --- ИЗМЕНЕНИЕ ЗДЕСЬ ---
-    sql_query = "INSERT INTO lectures (name, id_course, duration_hours, requirements, text_requirements) VALUES %s RETURNING id, id_course, name;"
-    results_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено лекций: {len(results_tuples)}")
-    # --- И ИЗМЕНЕНИЕ ЗДЕСЬ ---
-    return [{"id": r[0], "id_course": r[1], "name": r[2]} for r in results_tuples]
+    lecture_ids = allocate_ids(cur, "lectures", len(lectures_props))
+    values = [(lecture_id, l["name"], l["id_course"], l["duration_hours"], l["requirements"], l["text_requirements"]) for lecture_id, l in zip(lecture_ids, lectures_props)]
+    inserted = insert_rows(cur, "lectures", ("id", "name", "id_course", "duration_hours", "requirements", "text_requirements"), values)
+    print(f"Вставлено лекций: {inserted}")
+    return [{"id": lecture_id, "id_course": l["id_course"], "name": l["name"]} for lecture_id, l in zip(lecture_ids, lectures_props)]
 
 def insert_materials(cur, lectures):
     materials_props = []
@@ -458,20 +506,20 @@ def insert_materials(cur, lectures):
                 "id_lect": lec_id,
                 "full_text_description": f"Материал для лекции: {lec['name']}. {fake.text(max_nb_chars=300)}"
             })
-            if len(materials_props) >= 1500:
+            if len(materials_props) >= VOLUMES["materials"]:
                 break
-        if len(materials_props) >= 1500:
+        if len(materials_props) >= VOLUMES["materials"]:
              break
     
     if not materials_props:
         print("Нет материалов для вставки.")
         return []
-        
-    values = [(m["name"], m["id_lect"], m["full_text_description"]) for m in materials_props]
-    sql_query = "INSERT INTO materials (name, id_lect, full_text_description) VALUES %s RETURNING id, id_lect;"
-    results_tuples = execute_values(cur, sql_query, values, fetch=True)
-    print(f"Вставлено материалов: {len(results_tuples)}")
-    return [{"id": r[0], "id_lect": r[1]} for r in results_tuples]
+
+    material_ids = allocate_ids(cur, "materials", len(materials_props))
+    values = [(material_id, m["name"], m["id_lect"], m["full_text_description"]) for material_id, m in zip(material_ids, materials_props)]
+    inserted = insert_rows(cur, "materials", ("id", "name", "id_lect", "full_text_description"), values)
+    print(f"Вставлено материалов: {inserted}")
+    return [{"id": material_id, "id_lect": m["id_lect"]} for material_id, m in zip(material_ids, materials_props)]
 
 
 def insert_schedule(cur, groups, lectures):
@@ -483,7 +531,7 @@ def insert_schedule(cur, groups, lectures):
 
     for group in groups:
         group_id = group["id"]
-        num_schedules_per_group = random.randint(5, 7)
+        num_schedules_per_group = random.randint(*VOLUMES["schedules_per_group"])
         
         available_lectures_for_group = random.sample(lectures, min(len(lectures), num_schedules_per_group * 2))
 
@@ -502,98 +550,83 @@ def insert_schedule(cur, groups, lectures):
         print("Нет записей для вставки в расписание.")
         return []
 
-    values = [(s["auditorium"], s["id_lect"], s["id_group"], s["capacity"]) for s in schedules_props]
-    sql_query = """INSERT INTO schedule (auditorium, id_lect, id_group, capacity) VALUES %s RETURNING id;"""
-    
-    returned_ids_tuples = execute_values(cur, sql_query, values, fetch=True) # [(id1,), (id2,), ...]
-    print(f"Вставлено записей в расписание: {len(returned_ids_tuples)}")
-
-    if len(returned_ids_tuples) == len(schedules_props):
-        for i, id_tuple in enumerate(returned_ids_tuples):
-            schedules_props[i]["id"] = id_tuple[0]
-    else:
-        print(f"Предупреждение: Количество возвращенных ID расписаний ({len(returned_ids_tuples)}) не совпадает с количеством для вставки ({len(schedules_props)})")
+    for schedule, schedule_id in zip(schedules_props, allocate_ids(cur, "schedule", len(schedules_props))):
+        schedule["id"] = schedule_id
+    values = [(s["id"], s["auditorium"], s["id_lect"], s["id_group"], s["capacity"]) for s in schedules_props]
+    inserted = insert_rows(cur, "schedule", ("id", "auditorium", "id_lect", "id_group", "capacity"), values)
+    print(f"Вставлено записей в расписание: {inserted}")
 
     return schedules_props
 
 
-def insert_visits(cur, students, schedules):
-    visits_to_insert = [] # Список кортежей для execute_values
-    
-    if not students or not schedules:
-        print("Нет студентов или расписаний для генерации посещений.")
-        return 0
+VISIT_SLOTS = [time(9), time(11), time(13), time(15)]
+VISIT_COLUMNS = ("id_student", "id_schedule", "visitTime", "week_start", "status")
 
-    group_students_map = {}
-    for st in students:
-        group_id = st["id_group"]
-        if group_id not in group_students_map:
-            group_students_map[group_id] = []
-        group_students_map[group_id].append(st["id"])
+def generate_visit_weeks(students, schedules):
+    """Посещения семестра по неделям: каждая неделя - список строк, упорядоченный по visitTime.
 
+    У каждого студента VOLUMES["visits_per_student"] (40-50) посещений в случайные дни семестра. Они раскладываются по неделям
+    последовательно (биномиально по доле оставшихся дней), поэтому распределение то же, что при
+    выборе дня для каждого посещения, а в памяти держится только одна неделя.
+    """
     group_schedules_map = {}
     for sch in schedules:
-        group_id = sch["id_group"]
-        sch_id = sch["id"]
-        if group_id not in group_schedules_map:
-            group_schedules_map[group_id] = []
-        group_schedules_map[group_id].append(sch_id)
-
-    temp_visits_set = set()
-
-    for group_id, student_ids_in_group in group_students_map.items():
-        schedule_ids_for_group = group_schedules_map.get(group_id, [])
-        if not schedule_ids_for_group:
-            continue # Нет расписаний для этой группы
-
-        for st_id in student_ids_in_group:
-            num_visits_for_student = random.randint(40, 50)
-            
-            student_visit_count = 0
-            for _ in range(num_visits_for_student):
+        group_schedules_map.setdefault(sch["id_group"], []).append(sch["id"])
+
+    plan = [
+        (st["id"], group_schedules_map[st["id_group"]])
+        for st in students
+        if st["id_group"] in group_schedules_map
+    ]
+    visits_left = [random.randint(*VOLUMES["visits_per_student"]) for _ in plan]
+
+    first_day = start_date_semester.date()
+    last_day = end_date_semester.date()
+    days_left = (last_day - first_day).days + 1
+    week_start = get_week_start(first_day)
+    while week_start <= last_day:
+        week_days = [
+            day for day in (week_start + timedelta(days=i) for i in range(7))
+            if first_day <= day <= last_day
+        ]
+        week_visits = []
+        week_keys = set()
+        for i, (st_id, schedule_ids_for_group) in enumerate(plan):
+            if not visits_left[i]:
+                continue
+            num_visits = random.binomialvariate(visits_left[i], len(week_days) / days_left)
+            visits_left[i] -= num_visits
+            for _ in range(num_visits):
                 schedule_id_for_visit = random.choice(schedule_ids_for_group)
-                visit_time = generate_random_date(start_date_semester, end_date_semester)
-                week_start = get_week_start(visit_time)
+                visit_time = datetime.combine(random.choice(week_days), random.choice(VISIT_SLOTS))
                 status = random.choice(['presence', 'absence', 'late'])
-                
-                visit_key = (st_id, schedule_id_for_visit, visit_time.isoformat())
-                if visit_key not in temp_visits_set:
-                    visits_to_insert.append(
-                        (st_id, schedule_id_for_visit, visit_time, week_start, status)
-                    )
-                    temp_visits_set.add(visit_key)
-                    student_visit_count +=1
-
-    if not visits_to_insert:
-        print("Нет данных для вставки в visits.")
+
+                visit_key = (st_id, schedule_id_for_visit, visit_time)
+                if visit_key not in week_keys:
+                    week_keys.add(visit_key)
+                    week_visits.append((st_id, schedule_id_for_visit, visit_time, week_start, status))
+        days_left -= len(week_days)
+        # Реальные посещения поступают по порядку времени; в том же порядке они и вставляются,
+        # чтобы физическое расположение строк (и BRIN по visitTime) было как в рабочей базе
+        week_visits.sort(key=lambda visit: visit[2])
+        yield week_start, week_visits
+        week_start += timedelta(days=7)
+
+def insert_visits(cur, students, schedules, loader=None):
+    if not students or not schedules:
+        print("Нет студентов или расписаний для генерации посещений.")
         return 0
-    
-    print(f"Подготовлено {len(visits_to_insert)} уникальных записей о посещаемости для вставки.")
 
-    # Пакетная вставка
-    batch_size = 10000
+    # Неделя генерируется и сразу загружается, поэтому память не растет с объемом посещений
     total_inserted_count = 0
-    
-    sql_query = """
-    INSERT INTO visits (id_student, id_schedule, visitTime, week_start, status)
-    VALUES %s
-    ON CONFLICT DO NOTHING 
-    RETURNING id; 
-    """
-
-    for i in range(0, len(visits_to_insert), batch_size):
-        batch = visits_to_insert[i:i + batch_size]
-        try:
-            inserted_ids_this_batch = execute_values(cur, sql_query, batch, fetch=True)
-            
-            actual_inserted_in_batch = len(inserted_ids_this_batch)
-            total_inserted_count += actual_inserted_in_batch
-            
-            print(f"Вставлено {actual_inserted_in_batch} записей посещаемости (в текущей пачке). Всего вставлено: {total_inserted_count}")
-        except Exception as e:
-            print(f"Ошибка при вставке партии посещений: {e}")
+    for week_start, week_visits in generate_visit_weeks(students, schedules):
+        if not week_visits:
             continue
-    
+        total_inserted_count += insert_rows(cur, "visits", VISIT_COLUMNS, week_visits, loader or VISITS_LOADER)
+        print(f"Неделя {week_start}: вставлено {len(week_visits)} записей посещаемости. Всего вставлено: {total_inserted_count}")
+
+    if not total_inserted_count:
+        print("Нет данных для вставки в visits.")
     print(f"Итого вставлено {total_inserted_count} записей посещаемости.")
     return total_inserted_count
 
@@ -794,6 +827,22 @@ def fetch_all(query, params=None):
         return cur.fetchall()
 
 # Основной процесс
+parser = argparse.ArgumentParser(description="Генерация данных РТУ МИРЭА в PostgreSQL")
+parser.add_argument("--loader", choices=LOADERS, default=LOADER, help="способ загрузки справочных таблиц")
+parser.add_argument("--visits-loader", choices=LOADERS, default=VISITS_LOADER, help="способ загрузки visits")
+parser.add_argument("--scale", type=float, default=1.0, help="множитель объема данных (SF), например 10, 100, 1000")
+for name, value in VOLUMES.items():
+    if isinstance(value, tuple):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, nargs=2, metavar=("MIN", "MAX"), help=f"по умолчанию {value[0]} {value[1]}")
+    else:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, help=f"по умолчанию {value}" + (" * --scale" if name in SCALED_VOLUMES else ""))
+args = parser.parse_args()
+LOADER = args.loader
+VISITS_LOADER = args.visits_loader
+# Явно заданные объемы не масштабируются
+VOLUMES = scale_volumes(args.scale, {name: getattr(args, name) for name in VOLUMES})
+print(f"Объемы данных: {VOLUMES}")
+
 try:
     print("Генерация данных для РТУ МИРЭА")
     clear_all_data()
@@ -0,0 +1,217 @@
+import argparse
+import os
+import re
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2 import sql
+
+# Обслуживание недельных партиций visits (RANGE по week_start, по партиции на ISO-неделю):
+# партиции создаются заранее на PARTITION_WEEKS_AHEAD недель вперед, строки, попавшие
+# в DEFAULT-партицию, переносятся в недельные партиции, а недели старше
+# PARTITION_RETENTION_WEEKS отсоединяются и архивируются (или удаляются)
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "mirea")
+POSTGRES_DB = os.getenv("POSTGRES_DB", "university")
+
+PARTITION_WEEKS_AHEAD = int(os.getenv("PARTITION_WEEKS_AHEAD", 8))
+# 0 - старые партиции не трогаются
+PARTITION_RETENTION_WEEKS = int(os.getenv("PARTITION_RETENTION_WEEKS", 0))
+# Пустая строка - отсоединенные партиции удаляются, иначе переносятся в эту схему
+PARTITION_ARCHIVE_SCHEMA = os.getenv("PARTITION_ARCHIVE_SCHEMA", "archive")
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 3600))
+
+DEFAULT_PARTITION = "visits_default"
+PARTITION_BOUND = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+
+
+def get_week_start(day):
+    return day - timedelta(days=day.weekday())
+
+def partition_name(week_start):
+    # week_start - понедельник, поэтому ISO-год недели совпадает с годом из isocalendar()
+    iso_year, iso_week, _ = week_start.isocalendar()
+    return f"visits_{iso_year}_w{iso_week:02d}"
+
+def list_partitions(cur):
+    """Недельные партиции visits: {week_start: имя партиции}."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass
+    """)
+    partitions = {}
+    for relname, bound in cur.fetchall():
+        match = PARTITION_BOUND.search(bound)
+        if match:
+            partitions[date.fromisoformat(match.group(1))] = relname
+    return partitions
+
+def ensure_default_partition(conn):
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF visits DEFAULT")
+                .format(sql.Identifier(DEFAULT_PARTITION))
+            )
+
+def create_partition(conn, week_start):
+    """Создает партицию недели week_start, забирая ее строки из DEFAULT-партиции."""
+    name = sql.Identifier(partition_name(week_start))
+    default = sql.Identifier(DEFAULT_PARTITION)
+    week_end = week_start + timedelta(days=7)
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE week_start >= %s AND week_start < %s)").format(default),
+                (week_start, week_end),
+            )
+            if not cur.fetchone()[0]:
+                cur.execute(
+                    sql.SQL("CREATE TABLE {} PARTITION OF visits FOR VALUES FROM (%s) TO (%s)").format(name),
+                    (week_start, week_end),
+                )
+                print(f"Создана партиция {partition_name(week_start)}")
+                return
+            # С такими строками в DEFAULT новую партицию создать нельзя: строки переносятся
+            # в отдельную таблицу, которая затем присоединяется. Это DML по партициям, а не
+            # по visits, поэтому триггеры visits_weekly_rollup не срабатывают и итоги не меняются
+            cur.execute(
+                sql.SQL("CREATE TABLE {} (LIKE visits INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(name)
+            )
+            cur.execute(
+                sql.SQL("""
+                    WITH moved AS (
+                        DELETE FROM {} WHERE week_start >= %s AND week_start < %s RETURNING *
+                    )
+                    INSERT INTO {} SELECT * FROM moved
+                """).format(default, name),
+                (week_start, week_end),
+            )
+            moved = cur.rowcount
+            cur.execute(
+                sql.SQL("ALTER TABLE visits ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(name),
+                (week_start, week_end),
+            )
+            print(f"Создана партиция {partition_name(week_start)}, перенесено из {DEFAULT_PARTITION}: {moved}")
+
+def create_partitions(conn, first_week, last_week):
+    """Создает недостающие партиции для недель first_week..last_week включительно."""
+    with conn.cursor() as cur:
+        existing = list_partitions(cur)
+    conn.commit()
+    week_start = get_week_start(first_week)
+    created = 0
+    while week_start <= last_week:
+        if week_start not in existing:
+            create_partition(conn, week_start)
+            created += 1
+        week_start += timedelta(days=7)
+    return created
+
+def retire_partition(conn, week_start, relname, archive_schema):
+    """Отсоединяет партицию и удаляет недельные итоги ее недели."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("ALTER TABLE visits DETACH PARTITION {}").format(sql.Identifier(relname)))
+            # Отсоединение не вызывает триггеры visits, итоги недели удаляются явно
+            cur.execute(
+                "DELETE FROM visits_weekly_rollup WHERE week_start >= %s AND week_start < %s",
+                (week_start, week_start + timedelta(days=7)),
+            )
+            if archive_schema:
+                archived = sql.Identifier(archive_schema, relname)
+                cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(archive_schema)))
+                cur.execute("SELECT to_regclass(%s)", (f'"{archive_schema}"."{relname}"',))
+                if cur.fetchone()[0] is None:
+                    cur.execute(
+                        sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(sql.Identifier(relname), sql.Identifier(archive_schema))
+                    )
+                    print(f"Партиция {relname} перенесена в схему {archive_schema}")
+                else:
+                    # Неделя уже в архиве (запоздавшие строки снова завели ее партицию): строки дописываются
+                    cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(archived, sql.Identifier(relname)))
+                    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(relname)))
+                    print(f"Строки партиции {relname} дописаны в {archive_schema}.{relname}")
+            else:
+                cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(relname)))
+                print(f"Партиция {relname} удалена")
+
+def maintain_partitions(conn, weeks_ahead=PARTITION_WEEKS_AHEAD, retention_weeks=PARTITION_RETENTION_WEEKS,
+                        archive_schema=PARTITION_ARCHIVE_SCHEMA, today=None):
+    today = today or date.today()
+    current_week = get_week_start(today)
+    cutoff = current_week - timedelta(weeks=retention_weeks) if retention_weeks else date.min
+
+    ensure_default_partition(conn)
+    created = create_partitions(conn, current_week, current_week + timedelta(weeks=weeks_ahead))
+
+    # Строки вне заранее созданного окна (прошлые годы, опечатки в датах) попадают в DEFAULT;
+    # для каждой их недели заводится своя партиция, чтобы отчеты отсекали партиции по неделям.
+    # week_start не обязан быть понедельником, поэтому значения приводятся к началу ISO-недели.
+    # Недели старше срока хранения тоже получают партицию: ниже она отсоединяется и архивируется
+    # вместе с недельными итогами, а не остается в DEFAULT, которую читает каждый отчет
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("SELECT DISTINCT date_trunc('week', week_start)::date FROM {} ORDER BY 1")
+            .format(sql.Identifier(DEFAULT_PARTITION))
+        )
+        default_weeks = [row[0] for row in cur.fetchall()]
+        existing = list_partitions(cur)
+    conn.commit()
+    for week_start in default_weeks:
+        if week_start in existing:
+            continue
+        # Ошибка одной недели не должна останавливать остальные недели и отсоединение старых
+        try:
+            create_partition(conn, week_start)
+            created += 1
+        except psycopg2.Error as e:
+            print(f"Не удалось создать партицию {partition_name(week_start)}: {e}")
+
+    retired = 0
+    if retention_weeks:
+        with conn.cursor() as cur:
+            partitions = list_partitions(cur)
+        conn.commit()
+        for week_start, relname in sorted(partitions.items()):
+            if week_start < cutoff:
+                try:
+                    retire_partition(conn, week_start, relname, archive_schema)
+                    retired += 1
+                except psycopg2.Error as e:
+                    print(f"Не удалось отсоединить партицию {relname}: {e}")
+    print(f"Обслуживание партиций visits: создано {created}, отсоединено {retired}")
+    return created, retired
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание недельных партиций visits")
+    parser.add_argument("--weeks-ahead", type=int, default=PARTITION_WEEKS_AHEAD, help="на сколько недель вперед создавать партиции")
+    parser.add_argument("--retention-weeks", type=int, default=PARTITION_RETENTION_WEEKS, help="сколько недель хранить, 0 - без ограничения")
+    parser.add_argument("--archive-schema", default=PARTITION_ARCHIVE_SCHEMA, help="схема для отсоединенных партиций, пусто - удалять")
+    parser.add_argument("--loop", action="store_true", help="повторять каждые --interval секунд")
+    parser.add_argument("--interval", type=int, default=PARTITION_MAINTENANCE_INTERVAL)
+    args = parser.parse_args()
+
+    pg_conn = psycopg2.connect(
+        host=POSTGRES_HOST, port="5432", database=POSTGRES_DB,
+        user=POSTGRES_USER, password=POSTGRES_PASSWORD
+    )
+    try:
+        while True:
+            try:
+                maintain_partitions(pg_conn, args.weeks_ahead, args.retention_weeks, args.archive_schema)
+            except psycopg2.Error as e:
+                if not args.loop:
+                    raise
+                pg_conn.rollback()
+                print(f"Ошибка обслуживания партиций ({datetime.now():%Y-%m-%d %H:%M:%S}): {e}")
+            if not args.loop:
+                break
+            time.sleep(args.interval)
+    finally:
+        pg_conn.close()
@@ -103,6 +103,96 @@ CREATE TABLE IF NOT EXISTS visits (
 ) PARTITION BY RANGE (week_start);
 ALTER TABLE visits ADD FOREIGN KEY (id_student) REFERENCES students (id) ON DELETE CASCADE;
 ALTER TABLE visits ADD FOREIGN KEY (id_schedule) REFERENCES schedule (id) ON DELETE CASCADE;
+-- Посещения вне недельных партиций попадают сюда; недельные партиции создает partition_maintenance.py
+CREATE TABLE IF NOT EXISTS visits_default PARTITION OF visits DEFAULT;
+
+--недельные итоги посещений (поддерживаются триггерами на visits)
+CREATE TABLE IF NOT EXISTS visits_weekly_rollup (
+    week_start DATE NOT NULL,
+    id_student integer NOT NULL,
+    id_schedule integer NOT NULL,
+    total_visits integer NOT NULL,
+    attended_visits integer NOT NULL,
+    PRIMARY KEY (week_start, id_student, id_schedule)
+);
+
+-- Триггеры уровня оператора: изменения visits суммируются по (week_start, id_student, id_schedule)
+-- через таблицы переходов и применяются к итогам одним upsert'ом на оператор
+CREATE OR REPLACE FUNCTION visits_weekly_rollup_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO visits_weekly_rollup AS r (week_start, id_student, id_schedule, total_visits, attended_visits)
+        SELECT week_start, id_student, id_schedule,
+               COUNT(*), COUNT(*) FILTER (WHERE status IN ('presence', 'late'))
+        FROM new_rows
+        GROUP BY week_start, id_student, id_schedule
+        ON CONFLICT (week_start, id_student, id_schedule) DO UPDATE
+        SET total_visits = r.total_visits + EXCLUDED.total_visits,
+            attended_visits = r.attended_visits + EXCLUDED.attended_visits;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO visits_weekly_rollup AS r (week_start, id_student, id_schedule, total_visits, attended_visits)
+        SELECT week_start, id_student, id_schedule, SUM(total_delta), SUM(attended_delta)
+        FROM (
+            SELECT week_start, id_student, id_schedule, -1 AS total_delta,
+                   CASE WHEN status IN ('presence', 'late') THEN -1 ELSE 0 END AS attended_delta
+            FROM old_rows
+            UNION ALL
+            SELECT week_start, id_student, id_schedule, 1,
+                   CASE WHEN status IN ('presence', 'late') THEN 1 ELSE 0 END
+            FROM new_rows
+        ) AS delta
+        GROUP BY week_start, id_student, id_schedule
+        ON CONFLICT (week_start, id_student, id_schedule) DO UPDATE
+        SET total_visits = r.total_visits + EXCLUDED.total_visits,
+            attended_visits = r.attended_visits + EXCLUDED.attended_visits;
+        DELETE FROM visits_weekly_rollup r
+        USING old_rows o
+        WHERE r.week_start = o.week_start AND r.id_student = o.id_student AND r.id_schedule = o.id_schedule
+          AND r.total_visits = 0;
+    ELSE
+        UPDATE visits_weekly_rollup r
+        SET total_visits = r.total_visits - d.total_visits,
+            attended_visits = r.attended_visits - d.attended_visits
+        FROM (
+            SELECT week_start, id_student, id_schedule,
+                   COUNT(*) AS total_visits, COUNT(*) FILTER (WHERE status IN ('presence', 'late')) AS attended_visits
+            FROM old_rows
+            GROUP BY week_start, id_student, id_schedule
+        ) AS d
+        WHERE r.week_start = d.week_start AND r.id_student = d.id_student AND r.id_schedule = d.id_schedule;
+        DELETE FROM visits_weekly_rollup r
+        USING old_rows o
+        WHERE r.week_start = o.week_start AND r.id_student = o.id_student AND r.id_schedule = o.id_schedule
+          AND r.total_visits = 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Таблицы переходов допускают только одно событие на триггер
+DROP TRIGGER IF EXISTS visits_weekly_rollup_insert ON visits;
+CREATE TRIGGER visits_weekly_rollup_insert
+    AFTER INSERT ON visits
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION visits_weekly_rollup_apply();
+DROP TRIGGER IF EXISTS visits_weekly_rollup_update ON visits;
+CREATE TRIGGER visits_weekly_rollup_update
+    AFTER UPDATE ON visits
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION visits_weekly_rollup_apply();
+DROP TRIGGER IF EXISTS visits_weekly_rollup_delete ON visits;
+CREATE TRIGGER visits_weekly_rollup_delete
+    AFTER DELETE ON visits
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION visits_weekly_rollup_apply();
+
+-- Заполнение итогов для уже существующих посещений (на пустой таблице итогов)
+INSERT INTO visits_weekly_rollup (week_start, id_student, id_schedule, total_visits, attended_visits)
+SELECT week_start, id_student, id_schedule,
+       COUNT(*), COUNT(*) FILTER (WHERE status IN ('presence', 'late'))
+FROM visits
+GROUP BY week_start, id_student, id_schedule
+ON CONFLICT DO NOTHING;
 
 -- Промежуточная таблица для связи "многие ко многим" между kafedras и specialties
 CREATE TABLE IF NOT EXISTS kafedra_specialties (
@@ -113,4 +203,40 @@ CREATE TABLE IF NOT EXISTS kafedra_specialties (
     FOREIGN KEY (id_specialty) REFERENCES specialties (id) ON DELETE CASCADE
 );
 
+-- Индексы
+-- Внешние ключи справочников
+CREATE INDEX IF NOT EXISTS institutes_university_idx ON institutes (id_university);
+CREATE INDEX IF NOT EXISTS kafedras_institutes_idx ON kafedras (id_institutes);
+CREATE INDEX IF NOT EXISTS groups_kafedra_idx ON groups (id_kafedra);
+CREATE INDEX IF NOT EXISTS courses_kafedra_idx ON courses (id_kafedra);
+CREATE INDEX IF NOT EXISTS courses_specialty_idx ON courses (id_specialty);
+CREATE INDEX IF NOT EXISTS materials_lect_idx ON materials (id_lect);
+CREATE INDEX IF NOT EXISTS kafedra_specialties_specialty_idx ON kafedra_specialties (id_specialty);
+
+-- lab2: поиск курса по подстроке названия (ILIKE '%...%') по триграммам
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS courses_name_trgm_idx ON courses USING gin (name gin_trgm_ops);
+-- lab3: поиск группы по названию
+CREATE INDEX IF NOT EXISTS groups_name_idx ON groups (name);
+-- lab1 (s.id_group в semi-join) и lab3 (студенты группы): index-only по (id_group, id)
+CREATE INDEX IF NOT EXISTS students_group_idx ON students (id_group, id);
+-- lab2: лекции найденных курсов
+CREATE INDEX IF NOT EXISTS lectures_course_idx ON lectures (id_course);
+-- lab3: каталог специальных лекций (requirements = true)
+CREATE INDEX IF NOT EXISTS lectures_special_idx ON lectures (id) INCLUDE (id_course) WHERE requirements;
+-- lab1 (semi-join gs.id_group = s.id_group AND gs.id_lect = ANY(...)) и lab3 (расписание группы)
+CREATE INDEX IF NOT EXISTS schedule_group_lect_idx ON schedule (id_group, id_lect) INCLUDE (id);
+-- lab1/lab2: занятия по лекции
+CREATE INDEX IF NOT EXISTS schedule_lect_idx ON schedule (id_lect);
 
+-- visits: индексы объявлены на партиционированной таблице и создаются локально на каждой партиции
+-- lab1/lab3 крайние недели по студентам и занятиям, status и visitTime - для index-only
+CREATE INDEX IF NOT EXISTS visits_student_schedule_week_idx ON visits (id_student, id_schedule, week_start) INCLUDE (status, visitTime);
+-- lab2: EXISTS по занятию за период (он же индекс внешнего ключа id_schedule)
+CREATE INDEX IF NOT EXISTS visits_schedule_week_idx ON visits (id_schedule, week_start) INCLUDE (visitTime);
+-- Фильтр по диапазону visitTime (крайние недели отчетов, выборки по времени): посещения пишутся
+-- примерно по порядку времени, поэтому BRIN на каждой партиции дает почти ту же выборку, что B-tree,
+-- при размере в тысячи раз меньше и почти без затрат на вставку
+CREATE INDEX IF NOT EXISTS visits_visittime_brin_idx ON visits USING brin (visitTime) WITH (pages_per_range = 32);
+-- lab3: итоги по парам (студент, занятие) за диапазон недель
+CREATE INDEX IF NOT EXISTS visits_weekly_rollup_pair_idx ON visits_weekly_rollup (id_student, id_schedule, week_start) INCLUDE (attended_visits);
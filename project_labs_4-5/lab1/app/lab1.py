@@ -1,16 +1,27 @@
+import asyncio
+import base64
+import binascii
+import json
 import os
-from datetime import datetime
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from typing import Any, List, Optional
 
-import psycopg2
+import psycopg
 import redis
-from elasticsearch import Elasticsearch
+from aiokafka import AIOKafkaConsumer
+from aiokafka.errors import KafkaError
+from elasticsearch import AsyncElasticsearch
 from elasticsearch import exceptions as es_exceptions
-from fastapi import FastAPI, HTTPException, Query
-from neo4j import GraphDatabase
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from neo4j import AsyncGraphDatabase
 from neo4j import exceptions as neo4j_exceptions
-from psycopg2.extras import RealDictCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
 from pydantic import BaseModel, Field
+from redis import asyncio as aioredis
 
 # --- Подключение к бд ---
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres")
@@ -27,6 +38,16 @@ NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "mireamirea")
 ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST", "elasticsearch")
 ELASTICSEARCH_PORT = int(os.getenv("ELASTICSEARCH_PORT", 9200))
 ES_INDEX = "materials"
+ES_COMPOSITE_PAGE_SIZE = int(os.getenv("ES_COMPOSITE_PAGE_SIZE", 1000))
+
+# --- CDC (Debezium) ---
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS")  # например kafka:29092; без него кэш терминов живет только по TTL
+MATERIALS_CDC_TOPIC = "university-server.public.materials"
+TERM_LECTURES_TTL = int(os.getenv("TERM_LECTURES_TTL", 600))
+TERM_LECTURES_L1_SIZE = int(os.getenv("TERM_LECTURES_L1_SIZE", 1024))
+# Событие CDC приходит раньше, чем Elasticsearch sink проиндексирует изменение и индекс обновится
+# (задержка sink + refresh_interval); столько секунд после инвалидации результаты поиска не кэшируются
+TERM_LECTURES_INVALIDATION_GRACE = float(os.getenv("TERM_LECTURES_INVALIDATION_GRACE", 30))
 
 app = FastAPI(title="Lab1 Service")
 
@@ -44,56 +65,516 @@ class AttendanceReportItem(BaseModel):
     date_of_admission: str = Field(..., description="Дата поступления студента (YYYY-MM-DD)")
 
 # --- БД ---
-def get_pg_connection():
-    try:
-        conn = psycopg2.connect(
-            host=POSTGRES_HOST,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            port="5432"
+# Пулы и клиенты создаются один раз на старте приложения и переиспользуются всеми запросами
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 2))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
+REDIS_POOL_MAX = int(os.getenv("REDIS_POOL_MAX", 20))
+
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 10.0))
+
+pg_pool: Optional[AsyncConnectionPool] = None
+redis_client: Optional[aioredis.Redis] = None
+es_client: Optional[AsyncElasticsearch] = None
+neo4j_driver = None
+
+@app.on_event("startup")
+async def open_connection_pools():
+    global pg_pool, redis_client, es_client, neo4j_driver
+    pg_pool = AsyncConnectionPool(
+        "",
+        min_size=POSTGRES_POOL_MIN,
+        max_size=POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT,
+        kwargs={
+            "host": POSTGRES_HOST,
+            "dbname": POSTGRES_DB,
+            "user": POSTGRES_USER,
+            "password": POSTGRES_PASSWORD,
+            "port": 5432,
+            "autocommit": True,
+            "row_factory": dict_row,
+        },
+        open=False,
+    )
+    # Соединения открываются в фоне: Postgres может подняться позже сервиса
+    await pg_pool.open(wait=False)
+    redis_client = aioredis.Redis(
+        connection_pool=aioredis.ConnectionPool(
+            host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True, max_connections=REDIS_POOL_MAX
         )
-        return conn
-    except psycopg2.OperationalError as e:
+    )
+    es_client = AsyncElasticsearch(hosts=[{"host": ELASTICSEARCH_HOST, "port": ELASTICSEARCH_PORT, "scheme": "http"}])
+    neo4j_driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+@app.on_event("shutdown")
+async def close_connection_pools():
+    if pg_pool:
+        await pg_pool.close()
+    if redis_client:
+        await redis_client.connection_pool.disconnect()
+    if es_client:
+        await es_client.close()
+    if neo4j_driver:
+        await neo4j_driver.close()
+
+async def get_pg_connection():
+    try:
+        return await pg_pool.getconn()
+    except PoolTimeout as e:
         print(f"Error connecting to PostgreSQL: {e}")
         raise HTTPException(status_code=503, detail=f"PostgreSQL connection error: {e}")
 
+async def release_pg_connection(conn):
+    await pg_pool.putconn(conn)
+
 def get_redis_client():
-    try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-        r.ping()
-        return r
-    except redis.exceptions.ConnectionError as e:
-        print(f"Error connecting to Redis: {e}")
-        raise HTTPException(status_code=503, detail=f"Redis connection error: {e}")
+    return redis_client
 
 def get_es_client():
-    try:
-        es = Elasticsearch(hosts=[{"host": ELASTICSEARCH_HOST, "port": ELASTICSEARCH_PORT, "scheme": "http"}])
-        if not es.ping():
-            raise ConnectionError("Elasticsearch ping failed")
-        return es
-    except ConnectionError as e:
-        print(f"Error connecting to Elasticsearch: {e}")
-        raise HTTPException(status_code=503, detail=f"Elasticsearch connection error: {e}")
+    return es_client
 
 def get_neo4j_driver():
+    return neo4j_driver
+
+# --- Поиск лекций по термину ---
+async def resolve_lecture_ids(es_client, term):
+    # Уникальные id_lect собираются composite-агрегацией постранично (after_key),
+    # без передачи самих документов и без ограничения на число найденных лекций
+    lecture_ids = []
+    after_key = None
+    while True:
+        composite = {
+            "size": ES_COMPOSITE_PAGE_SIZE,
+            "sources": [{"id_lect": {"terms": {"field": "id_lect"}}}],
+        }
+        if after_key:
+            composite["after"] = after_key
+        es_query = {
+            "query": {"match": {"lecture_text": term}},
+            "size": 0,
+            "_source": False,
+            "track_total_hits": False,
+            "aggs": {"lectures": {"composite": composite}},
+        }
+        res = await es_client.search(index=ES_INDEX, body=es_query)
+        aggregation = res["aggregations"]["lectures"]
+        lecture_ids.extend(bucket["key"]["id_lect"] for bucket in aggregation["buckets"])
+        after_key = aggregation.get("after_key")
+        if not after_key or len(aggregation["buckets"]) < ES_COMPOSITE_PAGE_SIZE:
+            return lecture_ids
+
+# --- Кэш термин -> ID лекций ---
+TERM_LECTURES_KEY_PREFIX = "lab1:term_lectures:"
+
+def normalize_term(term):
+    return " ".join(term.lower().split())
+
+def term_lectures_key(normalized_term):
+    return f"{TERM_LECTURES_KEY_PREFIX}{normalized_term}"
+
+class TermLectureCache:
+    # L1 в памяти процесса перед Redis: LRU на max_size терминов с TTL.
+    # version растет при каждой инвалидации, чтобы результат поиска, начатого
+    # до события CDC, не попал в кэш после его очистки. Поиск, начатый в течение
+    # grace секунд после инвалидации, может еще видеть старый индекс и тоже не кэшируется
+    def __init__(self, ttl: float, max_size: int, grace: float):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.grace = grace
+        self.entries = OrderedDict()
+        self.version = 0
+        self.grace_until = 0.0
+
+    def get(self, term):
+        entry = self.entries.get(term)
+        if entry is None:
+            return None
+        expires_at, lecture_ids = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[term]
+            return None
+        self.entries.move_to_end(term)
+        return lecture_ids
+
+    def write_token(self):
+        # Берется до поиска; None - результат этого поиска в кэши не записывается
+        if time.monotonic() < self.grace_until:
+            return None
+        return self.version
+
+    def can_write(self, token):
+        return token is not None and token == self.version
+
+    def put(self, term, lecture_ids, token):
+        if not self.can_write(token):
+            return
+        self.entries[term] = (time.monotonic() + self.ttl, lecture_ids)
+        self.entries.move_to_end(term)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.version += 1
+        self.grace_until = time.monotonic() + self.grace
+        self.entries.clear()
+
+term_lectures = TermLectureCache(TERM_LECTURES_TTL, TERM_LECTURES_L1_SIZE, TERM_LECTURES_INVALIDATION_GRACE)
+
+async def get_lecture_ids_for_term(es_client, redis_client, term):
+    # L1 -> Redis -> Elasticsearch. Кэш только ускоряет запрос: при недоступном
+    # Redis ID лекций берутся напрямую из Elasticsearch
+    normalized_term = normalize_term(term)
+    lecture_ids = term_lectures.get(normalized_term)
+    if lecture_ids is not None:
+        return lecture_ids
+    token = term_lectures.write_token()
+    cached = None
+    try:
+        cached = await redis_client.get(term_lectures_key(normalized_term))
+    except redis.exceptions.RedisError as e:
+        print(f"Redis term cache read error: {e}")
+    if cached is not None:
+        lecture_ids = json.loads(cached)
+    else:
+        lecture_ids = await resolve_lecture_ids(es_client, normalized_term)
+        if term_lectures.can_write(token):
+            try:
+                await redis_client.setex(
+                    term_lectures_key(normalized_term), TERM_LECTURES_TTL, json.dumps(lecture_ids)
+                )
+            except redis.exceptions.RedisError as e:
+                print(f"Redis term cache write error: {e}")
+    term_lectures.put(normalized_term, lecture_ids, token)
+    return lecture_ids
+
+async def invalidate_term_lectures(redis_client):
+    term_lectures.clear()
+    deleted = 0
+    async for key in redis_client.scan_iter(match=f"{TERM_LECTURES_KEY_PREFIX}*", count=500):
+        deleted += await redis_client.delete(key)
+    print(f"Term cache invalidated: {deleted} Redis keys removed")
+
+async def consume_materials_changes():
+    while True:
+        consumer = AIOKafkaConsumer(
+            MATERIALS_CDC_TOPIC,
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            group_id=None,
+            auto_offset_reset="latest",
+        )
+        try:
+            await consumer.start()
+            print(f"Listening to CDC topic: {MATERIALS_CDC_TOPIC}")
+            while True:
+                # Пачка событий (например, массовая загрузка материалов) дает одну инвалидацию
+                batch = await consumer.getmany(timeout_ms=1000)
+                if any(batch.values()):
+                    try:
+                        await invalidate_term_lectures(get_redis_client())
+                    except redis.exceptions.RedisError as e:
+                        print(f"Redis term cache invalidation error: {e}")
+        except KafkaError as e:
+            # Пока Kafka недоступна, кэш терминов обновляется только по TTL
+            print(f"CDC consumer error: {e}. Retrying in 10 seconds...")
+        finally:
+            await consumer.stop()
+        await asyncio.sleep(10)
+
+cdc_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_cdc_consumer():
+    global cdc_task
+    if KAFKA_BOOTSTRAP_SERVERS:
+        cdc_task = asyncio.create_task(consume_materials_changes())
+
+@app.on_event("shutdown")
+async def stop_cdc_consumer():
+    if cdc_task:
+        cdc_task.cancel()
+
+# --- Дата поступления ---
+ADMISSION_DATE_TTL = 3600
+
+def admission_date_key(student_id):
+    return f"student:{student_id}:date_of_admission"
+
+async def resolve_admission_dates(cur, redis_client, student_ids):
+    # Один MGET по всем студентам, один запрос в Postgres на промахи и один pipeline с SETEX
+    student_ids = list(dict.fromkeys(student_ids))
+    if not student_ids:
+        return {}
+    cached = await redis_client.mget([admission_date_key(student_id) for student_id in student_ids])
+    dates = {student_id: value for student_id, value in zip(student_ids, cached) if value}
+    missing_ids = [student_id for student_id in student_ids if student_id not in dates]
+    if missing_ids:
+        await cur.execute(
+            "SELECT id, date_of_admission FROM students WHERE id = ANY(%s)", (missing_ids,)
+        )
+        for db_row in await cur.fetchall():
+            dates[db_row["id"]] = db_row["date_of_admission"].strftime("%Y-%m-%d")
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for student_id in missing_ids:
+                dates.setdefault(student_id, "Unknown")
+                pipe.setex(admission_date_key(student_id), ADMISSION_DATE_TTL, dates[student_id])
+            await pipe.execute()
+    return dates
+
+# --- Страницы отчета ---
+LAB1_MAX_LIMIT = int(os.getenv("LAB1_MAX_LIMIT", 1000))
+
+# --- Отбор студентов ---
+# neo4j: студенты, чьи группы посещали найденные лекции, берутся из графа и передаются
+# в SQL массивом ID; postgres: то же отношение группа -> лекция проверяется semi-join'ом
+# по schedule внутри одного SQL-запроса
+LAB1_STUDENT_SOURCE = os.getenv("LAB1_STUDENT_SOURCE", "postgres")
+STUDENT_SOURCES = ("postgres", "neo4j")
+
+STUDENT_FILTERS = {
+    "neo4j": "s.id = ANY(%(student_ids)s)",
+    "postgres": """EXISTS (
+            SELECT 1 FROM schedule gs
+            WHERE gs.id_group = s.id_group
+            AND gs.id_lect = ANY(%(lecture_ids)s)
+        )""",
+}
+
+# Полные недели периода берутся из visits_weekly_rollup, неполные крайние недели
+# (edge_weeks) досчитываются по visits с фильтром по visitTime
+ATTENDANCE_QUERY_TEMPLATE = """
+    WITH visit_counts AS (
+        SELECT r.id_student, r.id_schedule, r.total_visits, r.attended_visits
+        FROM visits_weekly_rollup r
+        WHERE r.week_start BETWEEN %(week_start_from)s AND %(week_start_to)s
+        AND r.week_start <> ALL(%(edge_weeks)s::date[])
+        UNION ALL
+        SELECT
+            v.id_student,
+            v.id_schedule,
+            1 AS total_visits,
+            CASE WHEN v.status IN ('presence', 'late') THEN 1 ELSE 0 END AS attended_visits
+        FROM visits v
+        WHERE v.week_start = ANY(%(edge_weeks)s::date[])
+        AND v.visitTime BETWEEN %(start_datetime)s AND %(end_datetime)s
+    ),
+    student_lecture_visits AS (
+        SELECT
+            s.id AS student_id,
+            s.fio AS full_name,
+            g.name AS group_name,
+            k.name AS department_name,
+            c.name AS course_name,
+            l.id AS lecture_id,
+            l.name AS lecture_name,
+            (SUM(vc.attended_visits)::FLOAT * 100.0 / NULLIF(SUM(vc.total_visits), 0)) AS attendance_percentage
+        FROM students s
+        JOIN groups g ON s.id_group = g.id
+        JOIN kafedras k ON g.id_kafedra = k.id
+        JOIN visit_counts vc ON s.id = vc.id_student
+        JOIN schedule sch ON vc.id_schedule = sch.id
+        JOIN lectures l ON sch.id_lect = l.id
+        JOIN courses c ON l.id_course = c.id
+        WHERE {student_filter}
+        AND l.id = ANY(%(lecture_ids)s)
+        GROUP BY s.id, s.fio, g.name, k.name, c.name, l.id, l.name
+    )
+    SELECT
+        student_id,
+        full_name,
+        group_name,
+        department_name,
+        course_name,
+        lecture_id,
+        lecture_name,
+        attendance_percentage
+    FROM student_lecture_visits
+    {keyset_filter}
+    ORDER BY attendance_percentage ASC NULLS LAST, student_id, lecture_id
+    LIMIT %(limit)s;
+"""
+
+# Продолжение выдачи после последней строки страницы (attendance_percentage, student_id, lecture_id)
+# в порядке ORDER BY attendance_percentage ASC NULLS LAST, student_id, lecture_id
+KEYSET_FILTERS = {
+    "first_page": "",
+    "after_value": """WHERE attendance_percentage > %(after_percentage)s
+        OR (attendance_percentage = %(after_percentage)s
+            AND (student_id, lecture_id) > (%(after_student_id)s, %(after_lecture_id)s))
+        OR attendance_percentage IS NULL""",
+    "after_null": """WHERE attendance_percentage IS NULL
+        AND (student_id, lecture_id) > (%(after_student_id)s, %(after_lecture_id)s)""",
+}
+
+def keyset_position(cursor):
+    if cursor is None:
+        return "first_page"
+    return "after_null" if cursor["attendance_percentage"] is None else "after_value"
+
+def build_attendance_query(student_source, cursor=None):
+    return ATTENDANCE_QUERY_TEMPLATE.format(
+        student_filter=STUDENT_FILTERS[student_source],
+        keyset_filter=KEYSET_FILTERS[keyset_position(cursor)],
+    )
+
+def encode_cursor(row):
+    payload = {
+        "attendance_percentage": row["attendance_percentage"],
+        "student_id": row["student_id"],
+        "lecture_id": row["lecture_id"],
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {
+            "attendance_percentage": None if payload["attendance_percentage"] is None else float(payload["attendance_percentage"]),
+            "student_id": int(payload["student_id"]),
+            "lecture_id": int(payload["lecture_id"]),
+        }
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def get_week_start(day: date) -> date:
+    # visits партиционирована по week_start - понедельнику недели посещения
+    return day - timedelta(days=day.weekday())
+
+def get_edge_weeks(period_start: date, period_end: date):
+    # Недели, которые период покрывает не целиком: для них итогов по неделе недостаточно
+    edge_weeks = []
+    if period_start.weekday() != 0:
+        edge_weeks.append(get_week_start(period_start))
+    if period_end.weekday() != 6 and get_week_start(period_end) not in edge_weeks:
+        edge_weeks.append(get_week_start(period_end))
+    return edge_weeks
+
+def attendance_query_params(student_ids, lecture_ids, period_start: date, period_end: date, limit=10, cursor=None):
+    # Границы week_start дублируют условие на visitTime, чтобы планировщик отсек лишние партиции.
+    # Запрашивается на одну строку больше limit, чтобы узнать, есть ли следующая страница;
+    # limit=None (потоковый режим) дает LIMIT NULL, то есть все строки
+    cursor = cursor or {}
+    return {
+        "limit": limit + 1 if limit is not None else None,
+        "after_percentage": cursor.get("attendance_percentage"),
+        "after_student_id": cursor.get("student_id"),
+        "after_lecture_id": cursor.get("lecture_id"),
+        "student_ids": student_ids,
+        "lecture_ids": lecture_ids,
+        "start_datetime": datetime.combine(period_start, datetime.min.time()),
+        "end_datetime": datetime.combine(period_end, datetime.max.time()),
+        "week_start_from": get_week_start(period_start),
+        "week_start_to": get_week_start(period_end),
+        "edge_weeks": get_edge_weeks(period_start, period_end),
+    }
+
+async def fetch_students_from_neo4j(neo4j_driver, lecture_ids):
     try:
-        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        driver.verify_connectivity()
-        return driver
+        async with neo4j_driver.session(database="neo4j") as session:
+            cypher_query = """
+            MATCH (s:Student)-[:BELONGS_TO]->(g:Group)-[att:ATTENDED]->(l:Lecture)
+            WHERE l.id IN $lecture_ids
+            RETURN DISTINCT s.id AS student_id
+            """
+            result = await session.run(cypher_query, lecture_ids=lecture_ids)
+            student_ids = [record["student_id"] async for record in result]
+        print(f"Neo4j found student_ids: {student_ids}")
+        return student_ids
     except neo4j_exceptions.ServiceUnavailable as e:
         print(f"Error connecting to Neo4j: {e}")
         raise HTTPException(status_code=503, detail=f"Neo4j connection error: {e}")
     except neo4j_exceptions.AuthError as e:
         print(f"Neo4j Authentication Error: {e}. Check credentials. URI: {NEO4J_URI}, User: {NEO4J_USER}")
         raise HTTPException(status_code=503, detail=f"Neo4j authentication error: {e}")
+    except Exception as e:
+        print(f"Neo4j query error: {e}")
+        raise HTTPException(status_code=500, detail=f"Neo4j query error: {e}")
+
+# --- Потоковая выдача (NDJSON) ---
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+
+def wants_ndjson(request: Request):
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def empty_report(stream):
+    return Response(content=b"", media_type=NDJSON_MEDIA_TYPE) if stream else []
+
+def build_report_item(row, term, start_date, end_date, date_of_admission):
+    return AttendanceReportItem(
+        student_id=row["student_id"],
+        full_name=row["full_name"],
+        group_name=row["group_name"],
+        department=row["department_name"],
+        course_name=row["course_name"],
+        attendance_percentage=row["attendance_percentage"],
+        period_start=start_date,
+        period_end=end_date,
+        matching_term=term,
+        date_of_admission=date_of_admission
+    )
+
+async def stream_attendance_report(sql_query, params, term, start_date, end_date):
+    # Строки читаются серверным курсором порциями по STREAM_CHUNK_SIZE, даты поступления
+    # подтягиваются на каждую порцию. Обработчик сам получает первую порцию до отправки
+    # заголовков (см. start_stream), поэтому нехватка соединений (503) и ошибка запроса (500)
+    # возвращаются статусом; ошибка после этого обрывает поток
+    pg_conn = await get_pg_connection()
+    redis_client = get_redis_client()
+    sent = 0
+    try:
+        async with pg_conn.transaction():
+            async with pg_conn.cursor(name="lab1_attendance_report") as cur, pg_conn.cursor() as lookup_cur:
+                await cur.execute(sql_query, params)
+                while True:
+                    rows = await cur.fetchmany(STREAM_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    admission_dates = await resolve_admission_dates(
+                        lookup_cur, redis_client, [row["student_id"] for row in rows]
+                    )
+                    yield "".join(
+                        build_report_item(row, term, start_date, end_date, admission_dates[row["student_id"]]).model_dump_json() + "\n"
+                        for row in rows
+                    )
+                    sent += len(rows)
+        print(f"Streamed {sent} report rows")
+    except psycopg.Error as e:
+        print(f"PostgreSQL query error after {sent} rows: {e}")
+        raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
+    except redis.exceptions.ConnectionError as e:
+        print(f"Error connecting to Redis after {sent} rows: {e}")
+        raise HTTPException(status_code=503, detail=f"Redis connection error: {e}")
+    except redis.exceptions.RedisError as e:
+        print(f"Redis query error after {sent} rows: {e}")
+        raise HTTPException(status_code=500, detail=f"Redis query error: {e}")
+    finally:
+        await release_pg_connection(pg_conn)
+
+async def prepend_chunk(first_chunk, chunks):
+    yield first_chunk
+    async for chunk in chunks:
+        yield chunk
+
+async def start_stream(chunks):
+    # Генератор запускается здесь, а не в StreamingResponse: Starlette может отменить ответ
+    # при отключении клиента до первой итерации, и у незапущенного генератора finally не
+    # выполнится. Запущенный генератор asyncio закроет (aclose) и тогда, соединение вернется в пул
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        return empty_report(True)
+    return StreamingResponse(prepend_chunk(first_chunk, chunks), media_type=NDJSON_MEDIA_TYPE)
 
 @app.get("/visits", response_model=List[AttendanceReportItem])
 async def generate_attendance_report(
+    request: Request,
+    response: Response,
     term: str = Query(..., description="Термин для поиска в описании курса"),
     start_date: str = Query(..., description="Дата начала периода (YYYY-MM-DD)"),
     end_date: str = Query(..., description="Дата окончания периода (YYYY-MM-DD)"),
+    strategy: Optional[str] = Query(None, description="Источник списка студентов: postgres или neo4j"),
+    limit: Optional[int] = Query(None, ge=1, le=LAB1_MAX_LIMIT, description="Размер страницы (по умолчанию 10; в потоковом режиме не поддерживается)"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из заголовка X-Next-Cursor"),
 ):
     lecture_ids = []
     student_ids_from_neo4j = []
@@ -104,155 +585,88 @@ async def generate_attendance_report(
         parsed_end_date = datetime.strptime(end_date, "%Y-%m-%d")
         if parsed_start_date > parsed_end_date:
             raise HTTPException(status_code=400, detail="Start date cannot be after end date.")
-        
-        sql_start_datetime = f"{start_date} 00:00:00"
-        sql_end_datetime = f"{end_date} 23:59:59"
 
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
 
-    # 1. Берем ID лекций из Elasticsearch
-    es_client = None
+    strategy = strategy or LAB1_STUDENT_SOURCE
+    if strategy not in STUDENT_SOURCES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of: {', '.join(STUDENT_SOURCES)}.")
+    # Accept: application/x-ndjson - весь отчет отдается потоком по мере чтения из базы,
+    # поэтому постраничная выдача в этом режиме не поддерживается
+    stream = wants_ndjson(request)
+    if stream and (limit is not None or cursor):
+        raise HTTPException(status_code=400, detail=f"limit and cursor are not supported for {NDJSON_MEDIA_TYPE}.")
+    after = decode_cursor(cursor) if cursor else None
+    if limit is None and not stream:
+        limit = 10
+
+    # 1. Берем ID лекций из кэша терминов или Elasticsearch
+    es_client = get_es_client()
     try:
-        es_client = get_es_client()
-        es_query = {
-            "query": {"match": {"lecture_text": term}},
-            "_source": ["id_lect"],
-            "size": 1000
-        }
-        res = es_client.search(index=ES_INDEX, body=es_query)
-        lecture_ids = list(set([hit["_source"]["id_lect"] for hit in res["hits"]["hits"]]))
+        lecture_ids = await get_lecture_ids_for_term(es_client, get_redis_client(), term)
         if not lecture_ids:
-            return []
+            return empty_report(stream)
         print(f"Elasticsearch found lecture_ids: {lecture_ids}")
     except es_exceptions.NotFoundError:
          print(f"Elasticsearch index '{ES_INDEX}' not found.")
-         return []
+         return empty_report(stream)
+    except es_exceptions.ConnectionError as e:
+        print(f"Error connecting to Elasticsearch: {e}")
+        raise HTTPException(status_code=503, detail=f"Elasticsearch connection error: {e}")
     except Exception as e:
         print(f"Elasticsearch query error: {e}")
         raise HTTPException(status_code=500, detail=f"Elasticsearch query error: {e}")
-    finally:
-        if es_client:
-            try:
-                pass
-            except Exception as e_close:
-                print(f"Error closing Elasticsearch client: {e_close}")
 
-    # 2. Получаем ID студентов из Neo4j
-    neo4j_driver = None
-    try:
-        neo4j_driver = get_neo4j_driver()
-        with neo4j_driver.session(database="neo4j") as session: 
-            cypher_query = """
-            MATCH (s:Student)-[:BELONGS_TO]->(g:Group)-[att:ATTENDED]->(l:Lecture)
-            WHERE l.id IN $lecture_ids
-            RETURN DISTINCT s.id AS student_id
-            """
-            result = session.run(cypher_query, lecture_ids=lecture_ids)
-            student_ids_from_neo4j = [record["student_id"] for record in result]
-            if not student_ids_from_neo4j:
-                return []
-        print(f"Neo4j found student_ids: {student_ids_from_neo4j}")
-    except Exception as e:
-        print(f"Neo4j query error: {e}")
-        raise HTTPException(status_code=500, detail=f"Neo4j query error: {e}")
-    finally:
-        if neo4j_driver:
-            neo4j_driver.close()
+    # 2. Получаем ID студентов из Neo4j (в режиме postgres студенты отбираются в самом SQL)
+    if strategy == "neo4j":
+        student_ids_from_neo4j = await fetch_students_from_neo4j(get_neo4j_driver(), lecture_ids)
+        if not student_ids_from_neo4j:
+            return empty_report(stream)
 
-    # 3. Получаем данные о посещаемости из PostgreSQL
-    pg_conn = None
-    redis_client = None
+    sql_query = build_attendance_query(strategy, after)
+    params = attendance_query_params(
+        student_ids_from_neo4j, lecture_ids, parsed_start_date.date(), parsed_end_date.date(), limit, after
+    )
+    if stream:
+        return await start_stream(stream_attendance_report(sql_query, params, term, start_date, end_date))
+
+    # 3. Получаем данные о посещаемости из PostgreSQL. Соединение берется до try, чтобы
+    # 503 при исчерпанном пуле не превратился в 500 в общем обработчике ниже
+    pg_conn = await get_pg_connection()
+    redis_client = get_redis_client()
     try:
-        pg_conn = get_pg_connection()
-        redis_client = get_redis_client()
-        with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-            sql_query = """
-            WITH student_lecture_visits AS (
-                SELECT
-                    s.id AS student_id,
-                    s.fio AS full_name,
-                    g.name AS group_name,
-                    k.name AS department_name,
-                    c.name AS course_name,
-                    l.id AS lecture_id,
-                    l.name AS lecture_name,
-                    COUNT(v.id) AS total_visits,
-                    SUM(CASE WHEN v.status IN ('presence', 'late') THEN 1 ELSE 0 END) AS attended_visits
-                FROM students s
-                JOIN groups g ON s.id_group = g.id
-                JOIN kafedras k ON g.id_kafedra = k.id
-                JOIN visits v ON s.id = v.id_student
-                JOIN schedule sch ON v.id_schedule = sch.id
-                JOIN lectures l ON sch.id_lect = l.id
-                JOIN courses c ON l.id_course = c.id
-                WHERE s.id = ANY(%(student_ids)s)
-                AND l.id = ANY(%(lecture_ids)s)
-                AND v.visitTime BETWEEN %(start_datetime)s AND %(end_datetime)s
-                GROUP BY s.id, s.fio, g.name, k.name, c.name, l.id, l.name
-            )
-            SELECT
-                student_id,
-                full_name,
-                group_name,
-                department_name,
-                course_name,
-                lecture_name,
-                (attended_visits::FLOAT * 100.0 / NULLIF(total_visits, 0)) AS attendance_percentage
-            FROM student_lecture_visits
-            ORDER BY attendance_percentage ASC NULLS LAST
-            LIMIT 10;
-"""
-            params = {
-                "student_ids": student_ids_from_neo4j,
-                "lecture_ids": lecture_ids,
-                "start_datetime": sql_start_datetime,
-                "end_datetime": sql_end_datetime,
-            }
-            cur.execute(sql_query, params)
-            results = cur.fetchall()
+        async with pg_conn.cursor() as cur:
+            await cur.execute(sql_query, params)
+            results = await cur.fetchall()
             print(f"PostgreSQL results: {results}")
+            if len(results) > limit:
+                results = results[:limit]
+                response.headers["X-Next-Cursor"] = encode_cursor(results[-1])
 
-            for row in results:
-                redis_key = f"student:{row['student_id']}:date_of_admission"
-                date_of_admission = redis_client.get(redis_key)
-                if not date_of_admission:
-                    cur.execute("SELECT date_of_admission FROM students WHERE id = %s", (row["student_id"],))
-                    db_result = cur.fetchone()
-                    date_of_admission = db_result["date_of_admission"].strftime("%Y-%m-%d") if db_result else "Unknown"
-                    redis_client.setex(redis_key, 3600, date_of_admission)
+            admission_dates = await resolve_admission_dates(
+                cur, redis_client, [row["student_id"] for row in results]
+            )
 
+            for row in results:
                 report_data.append(
-                    AttendanceReportItem(
-                        student_id=row["student_id"],
-                        full_name=row["full_name"],
-                        group_name=row["group_name"],
-                        department=row["department_name"],
-                        course_name=row["course_name"],
-                        attendance_percentage=row["attendance_percentage"],
-                        period_start=start_date,
-                        period_end=end_date,
-                        matching_term=term,
-                        date_of_admission=date_of_admission
-                    )
+                    build_report_item(row, term, start_date, end_date, admission_dates[row["student_id"]])
                 )
         return report_data
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         print(f"PostgreSQL query error: {e}")
-        pg_conn.rollback()
         raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
+    except redis.exceptions.ConnectionError as e:
+        print(f"Error connecting to Redis: {e}")
+        raise HTTPException(status_code=503, detail=f"Redis connection error: {e}")
     except redis.exceptions.RedisError as e:
         print(f"Redis query error: {e}")
         raise HTTPException(status_code=500, detail=f"Redis query error: {e}")
     except Exception as e:
         print(f"Unexpected error during processing: {e}")
-        if pg_conn: pg_conn.rollback()
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
     finally:
-        if pg_conn:
-            pg_conn.close()
-        if redis_client:
-            redis_client.close()
+        await release_pg_connection(pg_conn)
 
 @app.get("/")
 async def root():
@@ -1,12 +1,16 @@
 import os
-from datetime import datetime
-from typing import List
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 
-import psycopg2
-from fastapi import FastAPI, HTTPException, Query
-from neo4j import GraphDatabase
+import psycopg
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from neo4j import AsyncGraphDatabase
 from neo4j import exceptions as neo4j_exceptions
-from psycopg2.extras import RealDictCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
 from pydantic import BaseModel, Field
 
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres")
@@ -33,31 +37,57 @@ class CourseRequirementItem(BaseModel):
     year: int = Field(..., description="Год обучения")
 
 # --- бд ---
-def get_pg_connection():
+# Пул соединений и драйвер создаются один раз на старте приложения
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 2))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
+
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 10.0))
+
+pg_pool: Optional[AsyncConnectionPool] = None
+neo4j_driver = None
+
+@app.on_event("startup")
+async def open_connection_pools():
+    global pg_pool, neo4j_driver
+    pg_pool = AsyncConnectionPool(
+        "",
+        min_size=POSTGRES_POOL_MIN,
+        max_size=POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT,
+        kwargs={
+            "host": POSTGRES_HOST,
+            "dbname": POSTGRES_DB,
+            "user": POSTGRES_USER,
+            "password": POSTGRES_PASSWORD,
+            "port": 5432,
+            "autocommit": True,
+            "row_factory": dict_row,
+        },
+        open=False,
+    )
+    # Соединения открываются в фоне: Postgres может подняться позже сервиса
+    await pg_pool.open(wait=False)
+    neo4j_driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+@app.on_event("shutdown")
+async def close_connection_pools():
+    if pg_pool:
+        await pg_pool.close()
+    if neo4j_driver:
+        await neo4j_driver.close()
+
+async def get_pg_connection():
     try:
-        conn = psycopg2.connect(
-            host=POSTGRES_HOST,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            port="5432"
-        )
-        return conn
-    except psycopg2.OperationalError as e:
+        return await pg_pool.getconn()
+    except PoolTimeout as e:
         print(f"Error connecting to PostgreSQL: {e}")
         raise HTTPException(status_code=503, detail=f"PostgreSQL connection error: {e}")
 
+async def release_pg_connection(conn):
+    await pg_pool.putconn(conn)
+
 def get_neo4j_driver():
-    try:
-        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        driver.verify_connectivity()
-        return driver
-    except neo4j_exceptions.ServiceUnavailable as e:
-        print(f"Error connecting to Neo4j: {e}")
-        raise HTTPException(status_code=503, detail=f"Neo4j connection error: {e}")
-    except neo4j_exceptions.AuthError as e:
-        print(f"Neo4j Authentication Error: {e}. Check credentials. URI: {NEO4J_URI}, User: {NEO4J_USER}")
-        raise HTTPException(status_code=503, detail=f"Neo4j authentication error: {e}")
+    return neo4j_driver
 
 # --- подсчет семестра ---
 def get_semester_date_range(year: int, semester: int):
@@ -70,9 +100,200 @@ def get_semester_date_range(year: int, semester: int):
         end_date = f"{year}-06-30"
     return start_date, end_date
 
+def get_week_start(day: date) -> date:
+    # visits партиционирована по week_start - понедельнику недели посещения
+    return day - timedelta(days=day.weekday())
+
+# --- запрос к постгресу ---
+# Запрос идет от найденных курсов к их занятиям; для каждого занятия EXISTS проверяет
+# посещение за семестр по индексу visits_schedule_week_idx в отсеченных партициях
+COURSE_LECTURES_QUERY = """
+    SELECT
+        c.id AS course_id,
+        c.name AS course_name,
+        l.id AS lecture_id,
+        l.name AS lecture_topic,
+        l.text_requirements AS tech_requirements,
+        s.auditorium,
+        s.capacity AS current_capacity
+    FROM courses c
+    JOIN lectures l ON l.id_course = c.id
+    JOIN schedule s ON s.id_lect = l.id
+    WHERE c.id = ANY(%(course_ids)s)
+      AND EXISTS (
+          SELECT 1
+          FROM visits v
+          WHERE v.id_schedule = s.id
+          AND v.week_start BETWEEN %(week_start_from)s AND %(week_start_to)s
+          AND v.visitTime BETWEEN %(start_datetime)s AND %(end_datetime)s
+      )
+    ORDER BY l.id;
+"""
+
+def course_lectures_params(course_ids, period_start: date, period_end: date):
+    # Границы week_start дублируют условие на visitTime, чтобы планировщик отсек лишние партиции
+    return {
+        "course_ids": course_ids,
+        "start_datetime": datetime.combine(period_start, datetime.min.time()),
+        "end_datetime": datetime.combine(period_end, datetime.max.time()),
+        "week_start_from": get_week_start(period_start),
+        "week_start_to": get_week_start(period_end),
+    }
+
+# --- поиск курсов по названию ---
+# Подстрочный ILIKE обслуживается триграммным GIN-индексом courses_name_trgm_idx
+COURSE_IDS_QUERY = "SELECT id FROM courses WHERE name ILIKE %s ORDER BY id"
+COURSE_NAME_CACHE_TTL = int(os.getenv("COURSE_NAME_CACHE_TTL", 300))
+COURSE_NAME_CACHE_SIZE = int(os.getenv("COURSE_NAME_CACHE_SIZE", 1024))
+
+def course_name_pattern(course_name):
+    return f"%{course_name}%"
+
+class CourseNameCache:
+    # Кэш в памяти процесса: название (без учета регистра) -> ID подходящих курсов,
+    # LRU на max_size названий, записи живут ttl секунд
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, course_name):
+        entry = self.entries.get(course_name)
+        if entry is None:
+            return None
+        expires_at, course_ids = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[course_name]
+            return None
+        self.entries.move_to_end(course_name)
+        return course_ids
+
+    def put(self, course_name, course_ids):
+        self.entries[course_name] = (time.monotonic() + self.ttl, course_ids)
+        self.entries.move_to_end(course_name)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+course_names = CourseNameCache(COURSE_NAME_CACHE_TTL, COURSE_NAME_CACHE_SIZE)
+
+async def resolve_course_ids(course_name):
+    key = course_name.lower()
+    course_ids = course_names.get(key)
+    if course_ids is not None:
+        return course_ids
+    pg_conn = None
+    try:
+        pg_conn = await get_pg_connection()
+        async with pg_conn.cursor() as cur:
+            await cur.execute(COURSE_IDS_QUERY, (course_name_pattern(course_name),))
+            course_ids = [row["id"] for row in await cur.fetchall()]
+    except psycopg.Error as e:
+        print(f"PostgreSQL query error: {e}")
+        raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
+    finally:
+        if pg_conn:
+            await release_pg_connection(pg_conn)
+    print(f"PostgreSQL matched {len(course_ids)} courses for name: {course_name}")
+    course_names.put(key, course_ids)
+    return course_ids
+
+# --- кол-во студентов из neo4j ---
+async def fetch_student_counts(neo4j_driver, lecture_ids, start_date, end_date):
+    try:
+        async with neo4j_driver.session(database="neo4j") as session:
+            cypher_query = """
+            MATCH (g:Group)-[att:ATTENDED]->(l:Lecture)
+            WHERE l.id IN $lecture_ids
+            AND att.visitTime >= datetime($start_date)
+            AND att.visitTime <= datetime($end_date)
+            MATCH (s:Student)-[:BELONGS_TO]->(g)
+            RETURN l.id AS lecture_id, count(DISTINCT s) AS student_count
+            """
+            result = await session.run(cypher_query,
+                                      lecture_ids=lecture_ids,
+                                      start_date=start_date,
+                                      end_date=end_date)
+            student_counts = {record["lecture_id"]: record["student_count"] async for record in result}
+            print(f"Neo4j found student counts: {student_counts}")
+            return student_counts
+    except neo4j_exceptions.ServiceUnavailable as e:
+        print(f"Error connecting to Neo4j: {e}")
+        raise HTTPException(status_code=503, detail=f"Neo4j connection error: {e}")
+    except neo4j_exceptions.AuthError as e:
+        print(f"Neo4j Authentication Error: {e}. Check credentials. URI: {NEO4J_URI}, User: {NEO4J_USER}")
+        raise HTTPException(status_code=503, detail=f"Neo4j authentication error: {e}")
+    except neo4j_exceptions.Neo4jError as e:
+        print(f"Neo4j query error: {e}")
+        raise HTTPException(status_code=500, detail=f"Neo4j query error: {e}")
+
+def build_requirement_item(row, student_count, semester, year):
+    is_suitable = student_count <= row["current_capacity"] if student_count > 0 else False
+    return CourseRequirementItem(
+        course_id=row["course_id"],
+        course_name=row["course_name"],
+        lecture_topic=row["lecture_topic"],
+        tech_requirements=row["tech_requirements"] or "Нет требований",
+        student_count=student_count,
+        current_capacity=row["current_capacity"],
+        is_suitable=is_suitable,
+        semester=semester,
+        year=year
+    )
+
+# --- потоковая выдача (NDJSON) ---
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+
+def wants_ndjson(request: Request):
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def stream_course_requirements(params, start_date, end_date, semester, year):
+    # Лекции читаются серверным курсором порциями, кол-во студентов запрашивается в neo4j
+    # на каждую порцию. Первую порцию обработчик получает сам до отправки заголовков
+    # (см. start_stream), поэтому 503/500 возвращаются статусом; дальше ошибка обрывает поток
+    pg_conn = await get_pg_connection()
+    sent = 0
+    try:
+        async with pg_conn.transaction():
+            async with pg_conn.cursor(name="lab2_course_requirements") as cur:
+                await cur.execute(COURSE_LECTURES_QUERY, params)
+                while True:
+                    rows = await cur.fetchmany(STREAM_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    student_counts = await fetch_student_counts(
+                        get_neo4j_driver(), [row["lecture_id"] for row in rows], start_date, end_date
+                    )
+                    yield "".join(
+                        build_requirement_item(row, student_counts.get(row["lecture_id"], 0), semester, year).model_dump_json() + "\n"
+                        for row in rows
+                    )
+                    sent += len(rows)
+        print(f"Streamed {sent} course requirement rows")
+    except psycopg.Error as e:
+        print(f"PostgreSQL query error after {sent} rows: {e}")
+        raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
+    finally:
+        await release_pg_connection(pg_conn)
+
+async def prepend_chunk(first_chunk, chunks):
+    yield first_chunk
+    async for chunk in chunks:
+        yield chunk
+
+async def start_stream(chunks):
+    # генератор запускается здесь: незапущенный генератор, отмененный Starlette при отключении
+    # клиента, не выполнит finally и не вернет соединение в пул, а запущенный asyncio закроет сам
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        return Response(content=b"", media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(prepend_chunk(first_chunk, chunks), media_type=NDJSON_MEDIA_TYPE)
+
 # --- вывод ---
 @app.get("/course-requirements", response_model=List[CourseRequirementItem])
 async def get_course_requirements(
+    request: Request,
     course_name: str = Query(..., description="Название лекционного курса"),
     semester: int = Query(..., ge=1, le=8, description="Номер семестра (1-8)"),
     year: int = Query(..., description="Год обучения")
@@ -89,103 +310,46 @@ async def get_course_requirements(
         parsed_end_date = datetime.strptime(end_date, "%Y-%m-%d")
         if parsed_start_date > parsed_end_date:
             raise HTTPException(status_code=400, detail="Invalid date range for semester.")
-        
-        sql_start_datetime = f"{start_date} 00:00:00"
-        sql_end_datetime = f"{end_date} 23:59:59"
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format in semester calculation.")
 
+    # 0) ID курсов по названию (из кэша или по триграммному индексу)
+    stream = wants_ndjson(request)
+    course_ids = await resolve_course_ids(course_name)
+    if not course_ids:
+        return Response(content=b"", media_type=NDJSON_MEDIA_TYPE) if stream else []
+
+    params = course_lectures_params(course_ids, parsed_start_date.date(), parsed_end_date.date())
+    # Accept: application/x-ndjson - строки отдаются потоком по мере чтения из базы
+    if stream:
+        return await start_stream(stream_course_requirements(params, start_date, end_date, semester, year))
+
     # 1) получаем курсы и лекции из постгреса
     pg_conn = None
     course_data = []
     lecture_ids = []
     try:
-        pg_conn = get_pg_connection()
-        with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-            sql_query = """
-            SELECT
-                c.id AS course_id,
-                c.name AS course_name,
-                l.id AS lecture_id,
-                l.name AS lecture_topic,
-                l.text_requirements AS tech_requirements,
-                s.auditorium,
-                s.capacity AS current_capacity
-            FROM courses c
-            JOIN lectures l ON l.id_course = c.id
-            JOIN schedule s ON s.id_lect = l.id
-            WHERE c.name ILIKE %(course_name)s
-              AND s.id IN (
-                  SELECT sch.id
-                  FROM schedule sch
-                  JOIN visits v ON v.id_schedule = sch.id
-                  WHERE v.visitTime BETWEEN %(start_datetime)s AND %(end_datetime)s
-              )
-            ORDER BY l.id;
-            """
-            params = {
-                "course_name": f"%{course_name}%",
-                "start_datetime": sql_start_datetime,
-                "end_datetime": sql_end_datetime
-            }
-            cur.execute(sql_query, params)
-            course_data = cur.fetchall()
+        pg_conn = await get_pg_connection()
+        async with pg_conn.cursor() as cur:
+            await cur.execute(COURSE_LECTURES_QUERY, params)
+            course_data = await cur.fetchall()
             lecture_ids = [row['lecture_id'] for row in course_data]
             if not course_data:
                 return []
             print(f"PostgreSQL found {len(course_data)} lectures for course: {course_name}")
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         print(f"PostgreSQL query error: {e}")
-        if pg_conn:
-            pg_conn.rollback()
         raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
     finally:
         if pg_conn:
-            pg_conn.close()
+            await release_pg_connection(pg_conn)
 
     # 2: получаем кол-во студентов из neo4j
-    neo4j_driver = None
-    student_counts = {}
-    try:
-        neo4j_driver = get_neo4j_driver()
-        with neo4j_driver.session(database="neo4j") as session:
-            cypher_query = """
-            MATCH (g:Group)-[att:ATTENDED]->(l:Lecture)
-            WHERE l.id IN $lecture_ids
-            AND datetime(att.visitTime) >= datetime($start_date)
-            AND datetime(att.visitTime) <= datetime($end_date)
-            MATCH (s:Student)-[:BELONGS_TO]->(g)
-            RETURN l.id AS lecture_id, count(DISTINCT s) AS student_count
-            """
-            result = session.run(cypher_query, 
-                                lecture_ids=lecture_ids,
-                                start_date=start_date,
-                                end_date=end_date)
-            student_counts = {record["lecture_id"]: record["student_count"] for record in result}
-            print(f"Neo4j found student counts: {student_counts}")
-    except neo4j_exceptions.Neo4jError as e:
-        print(f"Neo4j query error: {e}")
-        raise HTTPException(status_code=500, detail=f"Neo4j query error: {e}")
-    finally:
-        if neo4j_driver:
-            neo4j_driver.close()
+    student_counts = await fetch_student_counts(get_neo4j_driver(), lecture_ids, start_date, end_date)
 
     for row in course_data:
-        lecture_id = row["lecture_id"]
-        student_count = student_counts.get(lecture_id, 0)
-        is_suitable = student_count <= row["current_capacity"] if student_count > 0 else False
         report_data.append(
-            CourseRequirementItem(
-                course_id=row["course_id"],
-                course_name=row["course_name"],
-                lecture_topic=row["lecture_topic"],
-                tech_requirements=row["tech_requirements"] or "Нет требований",
-                student_count=student_count,
-                current_capacity=row["current_capacity"],
-                is_suitable=is_suitable,
-                semester=semester,
-                year=year
-            )
+            build_requirement_item(row, student_counts.get(row["lecture_id"], 0), semester, year)
         )
 
     return report_data
@@ -1,15 +1,22 @@
+import asyncio
 import json
 import os
-from datetime import datetime
-from typing import List
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 
-import psycopg2
+import psycopg
 import redis
-from fastapi import FastAPI, HTTPException, Query
-from neo4j import GraphDatabase
+from aiokafka import AIOKafkaConsumer
+from aiokafka.errors import KafkaError
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from neo4j import AsyncGraphDatabase
 from neo4j import exceptions as neo4j_exceptions
-from psycopg2.extras import RealDictCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
 from pydantic import BaseModel, Field
+from redis import asyncio as aioredis
 
 # --- Database Configuration ---
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres")
@@ -24,6 +31,16 @@ NEO4J_URI = f"bolt://{os.getenv('NEO4J_HOST', 'neo4j')}:7687"
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "mireamirea")
 
+# --- CDC (Debezium) Configuration ---
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS")  # e.g. kafka:29092; unset disables CDC invalidation
+CATALOG_CDC_TOPICS = ["university-server.public.lectures", "university-server.public.courses"]
+SPECIAL_LECTURES_TTL = float(os.getenv("SPECIAL_LECTURES_TTL", 300))
+
+# Where the group's (student, lecture, schedule) tuples come from:
+# "postgres" - schedule filtered by id_group in SQL, no Neo4j round trip;
+# "neo4j" - the special lectures catalog filtered through the ATTENDED graph
+LAB3_SCHEDULE_SOURCE = os.getenv("LAB3_SCHEDULE_SOURCE", "postgres")
+
 app = FastAPI(title="Lab3 Service")
 
 # --- Response Model ---
@@ -37,237 +54,435 @@ class GroupAttendanceItem(BaseModel):
     date_of_admission: str = Field(..., description="Дата поступления студента (YYYY-MM-DD)")
 
 # --- Database Connections ---
-def get_pg_connection():
-    try:
-        conn = psycopg2.connect(
-            host=POSTGRES_HOST,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            port="5432",
-            cursor_factory=RealDictCursor
+# Pools and drivers are created once at startup and shared by all requests
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 2))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
+REDIS_POOL_MAX = int(os.getenv("REDIS_POOL_MAX", 20))
+
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 10.0))
+
+pg_pool: Optional[AsyncConnectionPool] = None
+redis_client: Optional[aioredis.Redis] = None
+neo4j_driver = None
+
+@app.on_event("startup")
+async def open_connection_pools():
+    global pg_pool, redis_client, neo4j_driver
+    pg_pool = AsyncConnectionPool(
+        "",
+        min_size=POSTGRES_POOL_MIN,
+        max_size=POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT,
+        kwargs={
+            "host": POSTGRES_HOST,
+            "dbname": POSTGRES_DB,
+            "user": POSTGRES_USER,
+            "password": POSTGRES_PASSWORD,
+            "port": 5432,
+            "autocommit": True,
+            "row_factory": dict_row,
+        },
+        open=False,
+    )
+    # Connections are opened in the background: Postgres may come up after this service
+    await pg_pool.open(wait=False)
+    redis_client = aioredis.Redis(
+        connection_pool=aioredis.ConnectionPool(
+            host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True, max_connections=REDIS_POOL_MAX
         )
-        return conn
-    except psycopg2.OperationalError as e:
+    )
+    neo4j_driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+@app.on_event("shutdown")
+async def close_connection_pools():
+    if pg_pool:
+        await pg_pool.close()
+    if redis_client:
+        await redis_client.connection_pool.disconnect()
+    if neo4j_driver:
+        await neo4j_driver.close()
+
+async def get_pg_connection():
+    try:
+        return await pg_pool.getconn()
+    except PoolTimeout as e:
         print(f"Error connecting to PostgreSQL: {e}")
         raise HTTPException(status_code=503, detail=f"PostgreSQL connection error: {e}")
 
+async def release_pg_connection(conn):
+    await pg_pool.putconn(conn)
+
 def get_redis_client():
-    try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-        r.ping()
-        return r
-    except redis.exceptions.ConnectionError as e:
-        print(f"Error connecting to Redis: {e}")
-        raise HTTPException(status_code=503, detail=f"Redis connection error: {e}")
+    return redis_client
 
 def get_neo4j_driver():
+    return neo4j_driver
+
+# --- Student details ---
+ADMISSION_DATE_TTL = 3600
+
+async def resolve_student_info(cur, redis_client, student_ids):
+    # One MGET for all profile and admission-date keys, one ANY() query for the misses
+    # and one SETEX pipeline to put them back into the cache
+    student_ids = list(student_ids)
+    if not student_ids:
+        return {}
+    keys = [f"student:{student_id}" for student_id in student_ids]
+    keys += [f"student:{student_id}:date_of_admission" for student_id in student_ids]
+    cached = await redis_client.mget(keys)
+    cached_profiles, cached_dates = cached[:len(student_ids)], cached[len(student_ids):]
+
+    student_info = {}
+    for student_id, student_data in zip(student_ids, cached_profiles):
+        student_info[student_id] = json.loads(student_data) if student_data else {"fio": "Unknown"}
+
+    missing_ids = []
+    for student_id, date_of_admission in zip(student_ids, cached_dates):
+        if date_of_admission:
+            student_info[student_id]["date_of_admission"] = date_of_admission
+        else:
+            missing_ids.append(student_id)
+
+    if missing_ids:
+        await cur.execute(
+            "SELECT id, date_of_admission FROM students WHERE id = ANY(%s)", (missing_ids,)
+        )
+        db_dates = {row["id"]: row["date_of_admission"].strftime("%Y-%m-%d") for row in await cur.fetchall()}
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for student_id in missing_ids:
+                date_of_admission = db_dates.get(student_id, "Unknown")
+                student_info[student_id]["date_of_admission"] = date_of_admission
+                pipe.setex(f"student:{student_id}:date_of_admission", ADMISSION_DATE_TTL, date_of_admission)  # Кэшируем на 1 час
+            await pipe.execute()
+    return student_info
+
+# --- Special lectures catalog ---
+class SpecialLectureCatalog:
+    # In-process cache of lecture_id -> {course_id, course_name, planned_hours} for lectures
+    # with requirements = true. Entries expire after a TTL or when a CDC event for
+    # lectures/courses invalidates them.
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lectures = {}
+        self.loaded_at = None
+        self.version = 0
+        self.lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+        self.loaded_at = None
+
+    def is_fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def get(self, cur):
+        if self.is_fresh():
+            return self.lectures
+        async with self.lock:
+            if not self.is_fresh():
+                version = self.version
+                await cur.execute(
+                    """
+                    SELECT c.id as course_id, c.name as course_name, c.planned_hours, l.id as lecture_id
+                    FROM courses c
+                    JOIN lectures l ON l.id_course = c.id
+                    WHERE l.requirements = true
+                    """
+                )
+                self.lectures = {row["lecture_id"]: row for row in await cur.fetchall()}
+                # An invalidation that arrived during the load leaves the catalog stale
+                if version == self.version:
+                    self.loaded_at = time.monotonic()
+                print(f"Special lectures catalog loaded: {len(self.lectures)} lectures")
+        return self.lectures
+
+special_lectures = SpecialLectureCatalog(SPECIAL_LECTURES_TTL)
+
+async def consume_catalog_changes():
+    while True:
+        consumer = AIOKafkaConsumer(
+            *CATALOG_CDC_TOPICS,
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            group_id=None,
+            auto_offset_reset="latest",
+        )
+        try:
+            await consumer.start()
+            print(f"Listening to CDC topics: {CATALOG_CDC_TOPICS}")
+            async for msg in consumer:
+                special_lectures.invalidate()
+        except KafkaError as e:
+            # Until Kafka is back the catalog is refreshed by TTL only
+            print(f"CDC consumer error: {e}. Retrying in 10 seconds...")
+        finally:
+            await consumer.stop()
+        await asyncio.sleep(10)
+
+cdc_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_cdc_consumer():
+    global cdc_task
+    # The special lecture catalog is only read in neo4j mode; postgres mode needs no consumer
+    if KAFKA_BOOTSTRAP_SERVERS and LAB3_SCHEDULE_SOURCE == "neo4j":
+        cdc_task = asyncio.create_task(consume_catalog_changes())
+
+@app.on_event("shutdown")
+async def stop_cdc_consumer():
+    if cdc_task:
+        cdc_task.cancel()
+
+# --- Attendance aggregation ---
+def aggregate_attendance(student_schedule_data, lecture_courses, attendance_by_pair):
+    # student_schedule_data: [(student_id, lecture_id, schedule_id)]
+    # lecture_courses: { lecture_id: course_id }
+    # attendance_by_pair: { (student_id, schedule_id): attended_hours }
+    student_attendance = {} # { student_id: { course_id: total_attended_hours_for_course } }
+    for student_id, lecture_id, schedule_id in student_schedule_data:
+        course_id = lecture_courses.get(lecture_id)
+        if course_id:
+            courses = student_attendance.setdefault(student_id, {})
+            courses[course_id] = courses.get(course_id, 0) + attendance_by_pair.get((student_id, schedule_id), 0)
+    return student_attendance
+
+# --- Report period ---
+def get_week_start(day: date) -> date:
+    # visits is partitioned by week_start, the Monday of the visit's week
+    return day - timedelta(days=day.weekday())
+
+def get_edge_weeks(period_start: date, period_end: date):
+    # Weeks only partly covered by the period: their weekly totals cannot be used as is
+    edge_weeks = []
+    if period_start.weekday() != 0:
+        edge_weeks.append(get_week_start(period_start))
+    if period_end.weekday() != 6 and get_week_start(period_end) not in edge_weeks:
+        edge_weeks.append(get_week_start(period_end))
+    return edge_weeks
+
+def parse_report_period(start_date: Optional[str], end_date: Optional[str]):
     try:
-        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        driver.verify_connectivity()
-        return driver
+        period_start = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else date.min
+        period_end = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else date.max
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+    if period_start > period_end:
+        raise HTTPException(status_code=400, detail="Start date cannot be after end date.")
+    return {
+        "start_datetime": datetime.combine(period_start, datetime.min.time()),
+        "end_datetime": datetime.combine(period_end, datetime.max.time()),
+        "week_start_from": get_week_start(period_start),
+        "week_start_to": get_week_start(period_end),
+        "edge_weeks": get_edge_weeks(period_start, period_end),
+    }
+
+# --- Neo4j ---
+async def fetch_student_schedule(group_id, lecture_ids):
+    neo4j_driver = get_neo4j_driver()
+    try:
+        async with neo4j_driver.session(database="neo4j") as session:
+            cypher_query = """
+            MATCH (s:Student)-[:BELONGS_TO]->(g:Group {id: $group_id})
+            MATCH (g)-[att:ATTENDED]->(l:Lecture)
+            WHERE l.id IN $lecture_ids
+            RETURN DISTINCT s.id AS student_id, l.id AS lecture_id, att.id_schedule AS schedule_id
+            """
+            result = await session.run(cypher_query, group_id=group_id, lecture_ids=lecture_ids)
+            return [(record["student_id"], record["lecture_id"], record["schedule_id"]) async for record in result]
     except neo4j_exceptions.ServiceUnavailable as e:
         print(f"Error connecting to Neo4j: {e}")
         raise HTTPException(status_code=503, detail=f"Neo4j connection error: {e}")
     except neo4j_exceptions.AuthError as e:
         print(f"Neo4j Authentication Error: {e}. Check credentials. URI: {NEO4J_URI}, User: {NEO4J_USER}")
         raise HTTPException(status_code=503, detail=f"Neo4j authentication error: {e}")
+    except neo4j_exceptions.Neo4jError as e:
+        print(f"Neo4j query error: {e}")
+        raise HTTPException(status_code=500, detail=f"Neo4j query error: {e}")
+
+# --- Group schedule from PostgreSQL ---
+GROUP_QUERY = """
+    SELECT g.id, k.name as department_name
+    FROM groups g
+    JOIN kafedras k ON g.id_kafedra = k.id
+    WHERE g.name = %s
+"""
+
+# Only the special lectures actually scheduled for the group, with their courses.
+# Schedule rows without any visit are skipped: Neo4j mode only sees lectures the group
+# has ATTENDED edges to, and both modes must produce the same report rows
+GROUP_SCHEDULE_QUERY = """
+    SELECT sch.id AS schedule_id, l.id AS lecture_id,
+           c.id AS course_id, c.name AS course_name, c.planned_hours
+    FROM schedule sch
+    JOIN lectures l ON l.id = sch.id_lect
+    JOIN courses c ON c.id = l.id_course
+    WHERE sch.id_group = %s
+    AND l.requirements = true
+    AND EXISTS (SELECT 1 FROM visits v WHERE v.id_schedule = sch.id)
+"""
+GROUP_STUDENTS_QUERY = "SELECT id FROM students WHERE id_group = %s"
+
+# Attended visits per (student, schedule) pair: full weeks come from visits_weekly_rollup,
+# partial edge weeks from raw visits
+GROUP_ATTENDANCE_QUERY = """
+    SELECT p.id_student, p.id_schedule, SUM(c.attended_visits) AS attended_hours
+    FROM unnest(%(student_ids)s::int[], %(schedule_ids)s::int[]) AS p(id_student, id_schedule)
+    JOIN (
+        SELECT r.id_student, r.id_schedule, r.attended_visits
+        FROM visits_weekly_rollup r
+        WHERE r.week_start BETWEEN %(week_start_from)s AND %(week_start_to)s
+        AND r.week_start <> ALL(%(edge_weeks)s::date[])
+        UNION ALL
+        SELECT v.id_student, v.id_schedule, 1
+        FROM visits v
+        WHERE v.status IN ('presence', 'late')
+        AND v.week_start = ANY(%(edge_weeks)s::date[])
+        AND v.visitTime BETWEEN %(start_datetime)s AND %(end_datetime)s
+    ) c ON c.id_student = p.id_student AND c.id_schedule = p.id_schedule
+    GROUP BY p.id_student, p.id_schedule;
+"""
+
+async def fetch_group_schedule(cur, group_id):
+    await cur.execute(GROUP_SCHEDULE_QUERY, (group_id,))
+    schedule_rows = await cur.fetchall()
+    if not schedule_rows:
+        return [], []
+    await cur.execute(GROUP_STUDENTS_QUERY, (group_id,))
+    student_ids = [row["id"] for row in await cur.fetchall()]
+    student_schedule_data = [
+        (student_id, row["lecture_id"], row["schedule_id"])
+        for student_id in student_ids
+        for row in schedule_rows
+    ]
+    return schedule_rows, student_schedule_data
+
+# --- Streaming (NDJSON) ---
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+
+def wants_ndjson(request: Request):
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def empty_report(stream):
+    return Response(content=b"", media_type=NDJSON_MEDIA_TYPE) if stream else []
+
+def iter_report_items(group_name, department_name, student_attendance, student_info, course_info):
+    for student_id, courses in student_attendance.items():
+        student_name = student_info.get(student_id, {}).get("fio", "Unknown")
+        date_of_admission = student_info.get(student_id, {}).get("date_of_admission", "Unknown")
+        for course_id, attended_hours in courses.items():
+            if course_id in course_info:
+                yield GroupAttendanceItem(
+                    group_name=group_name,
+                    student_name=student_name,
+                    course_name=course_info[course_id]["course_name"],
+                    planned_hours=course_info[course_id]["planned_hours"],
+                    attended_hours=attended_hours or 0,
+                    department=department_name,
+                    date_of_admission=date_of_admission
+                )
+
+async def stream_report_items(items):
+    # Rows are serialised and written in chunks of STREAM_CHUNK_SIZE instead of one JSON array
+    chunk = []
+    for item in items:
+        chunk.append(item.model_dump_json() + "\n")
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
 
 # --- Main Endpoint ---
 @app.get("/group", response_model=List[GroupAttendanceItem])
 async def get_group_attendance(
-    group_name: str = Query(..., description="Название группы")
+    request: Request,
+    group_name: str = Query(..., description="Название группы"),
+    start_date: Optional[str] = Query(None, description="Дата начала периода (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="Дата окончания периода (YYYY-MM-DD)"),
 ):
-    report_data = []
+    period = parse_report_period(start_date, end_date)
+    # Accept: application/x-ndjson - one JSON object per line, written as it is produced
+    stream = wants_ndjson(request)
 
-    # Step 1: Get group ID and special lectures (requirements = true) from PostgreSQL
-    pg_conn = None
-    group_id = None
-    lecture_data = []
+    # The whole request runs on one pooled connection inside one read-only,
+    # repeatable-read transaction, so every step sees the same snapshot
+    pg_conn = await get_pg_connection()
+    redis_client = get_redis_client()
     try:
-        pg_conn = get_pg_connection()
-        with pg_conn.cursor() as cur:
-            # Get group ID
-            cur.execute(
-                """
-                SELECT g.id, k.name as department_name
-                FROM groups g
-                JOIN kafedras k ON g.id_kafedra = k.id
-                WHERE g.name = %s
-                """,
-                (group_name,)
-            )
-            group_result = cur.fetchone()
-            if not group_result:
-                raise HTTPException(status_code=404, detail=f"Group {group_name} not found")
-            group_id = group_result["id"]
-            department_name = group_result["department_name"]
-
-            # Get special lectures (requirements = true) and their courses
-            cur.execute(
-                """
-                SELECT c.id as course_id, c.name as course_name, c.planned_hours, l.id as lecture_id
-                FROM courses c
-                JOIN lectures l ON l.id_course = c.id
-                WHERE l.requirements = true
-                """
-            )
-            lecture_data = cur.fetchall()
-            if not lecture_data:
-                return []
-            print(f"PostgreSQL found {len(lecture_data)} special lectures for group {group_name}")
-    except psycopg2.Error as e:
-        print(f"PostgreSQL query error: {e}")
-        if pg_conn:
-            pg_conn.rollback()
-        raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
-    finally:
-        if pg_conn:
-            pg_conn.close()
-
-    lecture_ids = [row["lecture_id"] for row in lecture_data]
-    course_info = {row["course_id"]: {
-        "course_name": row["course_name"],
-        "planned_hours": row["planned_hours"]
-    } for row in lecture_data}
-
-    # Step 2: Get students and schedule data from Neo4j
-    neo4j_driver = None
-    student_schedule_data = []
-    try:
-        neo4j_driver = get_neo4j_driver()
-        with neo4j_driver.session(database="neo4j") as session:
-            cypher_query = """
-            MATCH (s:Student)-[:BELONGS_TO]->(g:Group {id: $group_id})
-            MATCH (g)-[att:ATTENDED]->(l:Lecture)
-            WHERE l.id IN $lecture_ids
-            RETURN s.id AS student_id, l.id AS lecture_id, att.id_schedule AS schedule_id
-            """
-            result = session.run(cypher_query, group_id=group_id, lecture_ids=lecture_ids)
-            student_schedule_data = [(record["student_id"], record["lecture_id"], record["schedule_id"]) for record in result]
-            if not student_schedule_data:
-                return []
-            print(f"Neo4j found {len(student_schedule_data)} student-schedule records")
-    except neo4j_exceptions.Neo4jError as e:
-        print(f"Neo4j query error: {e}")
-        raise HTTPException(status_code=500, detail=f"Neo4j query error: {e}")
-    finally:
-        if neo4j_driver:
-            neo4j_driver.close()
+        async with pg_conn.transaction():
+            async with pg_conn.cursor() as cur:
+                await cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
 
-    # Step 3: Calculate attendance in PostgreSQL
-    pg_conn = None
-    student_attendance_raw = {} # { (student_id, schedule_id): attended_hours }
-    try:
-        pg_conn = get_pg_connection()
-        with pg_conn.cursor() as cur:
-            # Собираем уникальные пары (student_id, schedule_id)
-            unique_student_schedule_pairs = list(set((s_id, sch_id) for s_id, _, sch_id in student_schedule_data))
-
-            if unique_student_schedule_pairs:
-                values_placeholder = ','.join(cur.mogrify("(%s, %s)", (s_id, sch_id)).decode('utf-8')
-                                            for s_id, sch_id in unique_student_schedule_pairs)
-
-                pg_query_visits = f"""
-                SELECT id_student, id_schedule, COUNT(*) AS attended_hours
-                FROM visits
-                WHERE (id_student, id_schedule) IN ({values_placeholder})
-                AND status IN ('presence', 'late')
-                GROUP BY id_student, id_schedule;
-                """
-                cur.execute(pg_query_visits)
-                for row in cur.fetchall():
+                # Step 1: Get group ID from PostgreSQL
+                await cur.execute(GROUP_QUERY, (group_name,))
+                group_result = await cur.fetchone()
+                if not group_result:
+                    raise HTTPException(status_code=404, detail=f"Group {group_name} not found")
+                group_id = group_result["id"]
+                department_name = group_result["department_name"]
+
+                if LAB3_SCHEDULE_SOURCE == "neo4j":
+                    # Get special lectures (requirements = true) and their courses from the cached catalog
+                    lecture_data = list((await special_lectures.get(cur)).values())
+                    if not lecture_data:
+                        return empty_report(stream)
+                    print(f"PostgreSQL found {len(lecture_data)} special lectures for group {group_name}")
+
+                    # Step 2: Get students and schedule data from Neo4j
+                    lecture_ids = [row["lecture_id"] for row in lecture_data]
+                    student_schedule_data = await fetch_student_schedule(group_id, lecture_ids)
+                    if not student_schedule_data:
+                        return empty_report(stream)
+                    print(f"Neo4j found {len(student_schedule_data)} student-schedule records")
+                else:
+                    # Step 2: Get the group's special lectures, schedule and students from PostgreSQL
+                    lecture_data, student_schedule_data = await fetch_group_schedule(cur, group_id)
+                    if not student_schedule_data:
+                        return empty_report(stream)
+                    print(f"PostgreSQL found {len(student_schedule_data)} student-schedule records for group {group_name}")
+
+                lecture_courses = {row["lecture_id"]: row["course_id"] for row in lecture_data}
+                course_info = {row["course_id"]: {
+                    "course_name": row["course_name"],
+                    "planned_hours": row["planned_hours"]
+                } for row in lecture_data}
+
+                # Step 3: Calculate attendance in PostgreSQL
+                student_attendance_raw = {} # { (student_id, schedule_id): attended_hours }
+                # Собираем уникальные пары (student_id, schedule_id)
+                unique_student_schedule_pairs = list(set((s_id, sch_id) for s_id, _, sch_id in student_schedule_data))
+
+                # Пары передаются двумя параллельными массивами, текст запроса не зависит от размера группы
+                student_ids, schedule_ids = zip(*unique_student_schedule_pairs)
+
+                params = {"student_ids": list(student_ids), "schedule_ids": list(schedule_ids), **period}
+                await cur.execute(GROUP_ATTENDANCE_QUERY, params)
+                for row in await cur.fetchall():
                     student_attendance_raw[(row["id_student"], row["id_schedule"])] = row["attended_hours"]
-            else:
-                print("No unique student-schedule pairs to query attendance for.")
-
-        # Теперь агрегируем по lecture_id
-        student_attendance = {} # { student_id: { course_id: total_attended_hours_for_course } }
-        for student_id, lecture_id, schedule_id in student_schedule_data:
-            # Находим соответствующий course_id для lecture_id
-            current_course_id = next((data["course_id"] for data in lecture_data if data["lecture_id"] == lecture_id), None)
-
-            if current_course_id:
-                attended_hours_for_this_schedule = student_attendance_raw.get((student_id, schedule_id), 0)
-
-                if student_id not in student_attendance:
-                    student_attendance[student_id] = {}
-                if current_course_id not in student_attendance[student_id]:
-                    student_attendance[student_id][current_course_id] = 0
-
-                # Добавляем часы, полученные для этой конкретной связки (студент, расписание)
-                student_attendance[student_id][current_course_id] += attended_hours_for_this_schedule
-
-    except psycopg2.Error as e:
-        print(f"PostgreSQL query error during attendance calculation: {e}")
-        if pg_conn:
-            pg_conn.rollback()
-        raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
-    finally:
-        if pg_conn:
-            pg_conn.close()
 
-    # Step 4: Get student details and date_of_admission from Redis
-    redis_client = None
-    student_info = {}
-    try:
-        redis_client = get_redis_client()
-        pg_conn = None
-        try:
-            pg_conn = get_pg_connection()
-            with pg_conn.cursor() as cur:
-                for student_id in student_attendance.keys():
-                    # Попытка получить данные студента из Redis
-                    key = f"student:{student_id}"
-                    student_data = redis_client.get(key)
-                    if student_data:
-                        student_info[student_id] = json.loads(student_data)
-                    else:
-                        student_info[student_id] = {"fio": "Unknown"}
-
-                    # Получаем date_of_admission из Redis
-                    date_key = f"student:{student_id}:date_of_admission"
-                    date_of_admission = redis_client.get(date_key)
-                    if not date_of_admission:
-                        # Если данных нет в Redis, получаем из PostgreSQL и кэшируем
-                        cur.execute("SELECT date_of_admission FROM students WHERE id = %s", (student_id,))
-                        db_result = cur.fetchone()
-                        date_of_admission = db_result["date_of_admission"].strftime("%Y-%m-%d") if db_result else "Unknown"
-                        redis_client.setex(date_key, 3600, date_of_admission)  # Кэшируем на 1 час
-                    student_info[student_id]["date_of_admission"] = date_of_admission
-            print(f"Retrieved {len(student_info)} student records with date_of_admission")
-        except psycopg2.Error as e:
-            print(f"PostgreSQL query error for date_of_admission: {e}")
-            if pg_conn:
-                pg_conn.rollback()
-            raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
-        finally:
-            if pg_conn:
-                pg_conn.close()
+                # Теперь агрегируем по course_id за один проход
+                student_attendance = aggregate_attendance(student_schedule_data, lecture_courses, student_attendance_raw)
+
+                # Step 4: Get student details and date_of_admission from Redis
+                student_info = await resolve_student_info(cur, redis_client, student_attendance.keys())
+                print(f"Retrieved {len(student_info)} student records with date_of_admission")
+    except psycopg.Error as e:
+        print(f"PostgreSQL query error: {e}")
+        raise HTTPException(status_code=500, detail=f"PostgreSQL query error: {e}")
+    except redis.exceptions.ConnectionError as e:
+        print(f"Error connecting to Redis: {e}")
+        raise HTTPException(status_code=503, detail=f"Redis connection error: {e}")
     except redis.exceptions.RedisError as e:
         print(f"Redis query error: {e}")
         raise HTTPException(status_code=500, detail=f"Redis query error: {e}")
     finally:
-        if redis_client:
-            redis_client.close()
+        await release_pg_connection(pg_conn)
 
     # Step 5: Compile report data
-    for student_id, courses in student_attendance.items():
-        student_name = student_info.get(student_id, {}).get("fio", "Unknown")
-        date_of_admission = student_info.get(student_id, {}).get("date_of_admission", "Unknown")
-        for course_id, attended_hours in courses.items():
-            if course_id in course_info:
-                report_data.append(
-                    GroupAttendanceItem(
-                        group_name=group_name,
-                        student_name=student_name,
-                        course_name=course_info[course_id]["course_name"],
-                        planned_hours=course_info[course_id]["planned_hours"],
-                        attended_hours=attended_hours or 0,
-                        department=department_name,
-                        date_of_admission=date_of_admission
-                    )
-                )
+    items = iter_report_items(group_name, department_name, student_attendance, student_info, course_info)
+    if stream:
+        return StreamingResponse(stream_report_items(items), media_type=NDJSON_MEDIA_TYPE)
+    report_data = list(items)
 
     print(f"Generated report with {len(report_data)} entries")
     return report_data